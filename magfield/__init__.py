@@ -0,0 +1,13 @@
+"""Field engine for the LTM magnet scripts.
+
+The package only depends on NumPy; matplotlib is imported by
+:mod:`magfield.plotting` when a plot is actually drawn.
+"""
+
+from .grid import Grid, evaluate
+from .kernels import (DEFAULT_MAX_PAIRS, PRECISIONS, RING_LAYOUTS, RING_PROFILES, analytic_ring_field,
+                      axisymmetric_ring_field, charge_sum, line_pair_field, rectangle_field, ring_centers, ring_charges,
+                      ring_field)
+from .fmm import fmm_charge_sum
+from .sources import (RING_MODES, SUM_METHODS, AnalyticRing, AxisymmetricRing, Composite, LineChargePair,
+                      PointCharges, QuadratureRing, Rectangle, RingCharges, Source, ring_source)
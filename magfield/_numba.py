@@ -0,0 +1,63 @@
+"""Numba-compiled fused kernels, imported by :func:`magfield.backends.compiled`.
+
+Each function fills preallocated 1-D float64 outputs for 1-D contiguous
+inputs and one configuration; :mod:`magfield.kernels` handles broadcasting
+and configuration axes. Numba compiles one specialization per input dtype:
+float32 inputs give the ``precision='float32'`` kernels, whose per-source
+terms are computed in single precision and widened with ``np.float64``
+before they are accumulated, and whose logarithms are taken in float64,
+like the NumPy kernels. For float64 inputs the widening is a no-op.
+``error_model='numpy'`` keeps NumPy's inf/NaN results on a charge or corner
+instead of raising, and ``nogil`` lets other Python threads, such as an
+event loop, run while a kernel does.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(parallel=True, nogil=True, error_model='numpy', cache=True)
+def charge_sum(px, pz, charge_x, charge_z, weight, num_x, num_z, Bx, Bz, V):
+    # Empty num_x/num_z mean the numerators are the offsets dx/dz
+    fixed_x = num_x.size > 0
+    fixed_z = num_z.size > 0
+    for i in prange(px.size):
+        x = px[i]
+        z = pz[i]
+        bx = 0.0
+        bz = 0.0
+        v = 0.0
+        for k in range(charge_x.size):
+            dx = x - charge_x[k]
+            dz = z - charge_z[k]
+            r2 = dx * dx + dz * dz
+            scale = weight[k] / r2
+            bx += np.float64((num_z[k] if fixed_z else dz) * scale)
+            bz += np.float64((num_x[k] if fixed_x else dx) * scale)
+            v += np.float64(weight[k]) * np.log(np.float64(r2))
+        Bx[i] = bx
+        Bz[i] = bz
+        V[i] = 0.5 * v
+
+
+@njit(parallel=True, nogil=True, error_model='numpy', cache=True)
+def rectangle_field(px, pz, length, height, magnetization, Bx, Bz, V):
+    for i in prange(px.size):
+        # Corners 1 and 4 share the left edge, 2 and 3 the right; 1 and 2 the bottom, 3 and 4 the top
+        dx_left = px[i] + length / 2
+        dx_right = px[i] - length / 2
+        dz_bottom = pz[i] + height / 2
+        dz_top = pz[i] - height / 2
+        r2_1 = dx_left * dx_left + dz_bottom * dz_bottom
+        r2_2 = dx_right * dx_right + dz_bottom * dz_bottom
+        r2_3 = dx_right * dx_right + dz_top * dz_top
+        r2_4 = dx_left * dx_left + dz_top * dz_top
+        m = np.float64(magnetization)
+        Bx[i] = m * (np.float64(np.arctan(dz_bottom * dx_left / r2_1)) -
+                     np.float64(np.arctan(dz_bottom * dx_right / r2_2)) +
+                     np.float64(np.arctan(dz_top * dx_right / r2_3)) -
+                     np.float64(np.arctan(dz_top * dx_left / r2_4)))
+        Bz[i] = m * (np.float64(np.arctan(dz_bottom / dx_left)) - np.float64(np.arctan(dz_bottom / dx_right)) +
+                     np.float64(np.arctan(dz_top / dx_right)) - np.float64(np.arctan(dz_top / dx_left)))
+        V[i] = 0.5 * m * (np.log(np.float64(r2_1)) - np.log(np.float64(r2_2)) + np.log(np.float64(r2_3)) -
+                          np.log(np.float64(r2_4)))
@@ -0,0 +1,182 @@
+"""Adaptive quadtree evaluation.
+
+The grid domain is covered by square cells on an integer lattice. A cell is
+split into four while bilinear interpolation from its corners misses the
+field at its centre or at one of its edge midpoints by more than ``tol``, so
+points concentrate around the magnet edges and corners and the smooth far
+field is left coarse. The resulting leaves are only resampled to a regular
+grid for display. Cells of the finest level have no lattice points left to
+check, so the grid points inside them are evaluated exactly when resampling
+instead of interpolated. ``tol`` is only checked at five points per cell,
+so the resampled error can still exceed it next to isolated charges, whose
+peaks can fall between them. All new points of a level are evaluated in one
+kernel call.
+"""
+
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .cache import FIELD_NAMES
+
+
+class _PointStore:
+    # Field values at lattice points, kept sorted by key
+    def __init__(self, source, x0, dx, z0, dz, size):
+        self.source = source
+        self.x0, self.dx, self.z0, self.dz = x0, dx, z0, dz
+        self.size = size
+        self.keys = np.empty(0, dtype=np.int64)
+        self.values = np.empty((len(FIELD_NAMES), 0))
+
+    def key(self, ix, iz):
+        return ix.astype(np.int64) * (self.size + 1) + iz
+
+    def ensure(self, *keys):
+        """Evaluate the points of all ``keys`` arrays not stored yet, in one kernel call."""
+        wanted = np.unique(np.concatenate(keys))
+        pos = np.minimum(np.searchsorted(self.keys, wanted), max(self.keys.size - 1, 0))
+        missing = wanted[~(self.keys[pos] == wanted)] if self.keys.size else wanted
+        if missing.size:
+            mx, mz = np.divmod(missing, self.size + 1)
+            fields = np.array(self.source.field(self.x0 + mx * self.dx, self.z0 + mz * self.dz))
+            at = np.searchsorted(self.keys, missing)
+            self.keys = np.insert(self.keys, at, missing)
+            self.values = np.insert(self.values, at, fields, axis=1)
+
+    def lookup(self, keys):
+        return self.values[:, np.searchsorted(self.keys, keys)]
+
+
+@dataclass
+class AdaptiveField:
+    """Field sampled on the leaves of a quadtree.
+
+    ``leaves`` holds one ``(level, cells)`` pair per level, where ``cells`` is
+    an ``(n, 2)`` array of cell indices at that level. ``evaluations`` counts
+    the kernel evaluations that were needed, including those :meth:`resample`
+    makes inside cells of level ``max_depth``.
+    """
+
+    xmin: float
+    xmax: float
+    zmin: float
+    zmax: float
+    base: int
+    max_depth: int
+    leaves: list
+    evaluations: int
+    store: _PointStore = field(repr=False)
+
+    @property
+    def size(self):
+        return self.base * 2 ** self.max_depth
+
+    def cell_count(self):
+        """Return the number of leaf cells."""
+        return sum(len(cells) for _, cells in self.leaves)
+
+    def resample(self, grid):
+        """Interpolate the leaves bilinearly onto ``grid`` and return ``(Bx, Bz, V)`` indexed ``[i, j]``.
+
+        Grid points inside cells of level ``max_depth``, other than their
+        corners, are evaluated exactly in one kernel call and added to
+        ``evaluations``.
+        """
+        x, z = np.broadcast_arrays(grid.x[:, None], grid.z[None, :])
+        u = np.clip((x.ravel() - self.xmin) / (self.xmax - self.xmin) * self.size, 0, self.size)
+        v = np.clip((z.ravel() - self.zmin) / (self.zmax - self.zmin) * self.size, 0, self.size)
+        out = np.full((len(FIELD_NAMES), u.size), np.nan)
+        exact = np.zeros(u.size, dtype=bool)
+
+        for level, cells in self.leaves:
+            if not len(cells):
+                continue
+            step = 2 ** (self.max_depth - level)
+            count = self.size // step
+            a = np.minimum((u // step).astype(np.int64), count - 1)
+            b = np.minimum((v // step).astype(np.int64), count - 1)
+
+            # Points whose cell at this level is a leaf
+            leaf_keys = np.sort(cells[:, 0] * count + cells[:, 1])
+            keys = a * count + b
+            pos = np.minimum(np.searchsorted(leaf_keys, keys), len(leaf_keys) - 1)
+            hit = leaf_keys[pos] == keys
+            if not hit.any():
+                continue
+            if level == self.max_depth:
+                exact[hit] = True
+            a, b = a[hit], b[hit]
+            tu = (u[hit] - a * step) / step
+            tv = (v[hit] - b * step) / step
+            ix, iz = a * step, b * step
+
+            corners = [self.store.key(ix + di, iz + dj) for di, dj in ((0, 0), (step, 0), (0, step), (step, step))]
+            self.store.ensure(*corners)
+            f00, f10, f01, f11 = (self.store.lookup(k) for k in corners)
+            out[:, hit] = (f00 * (1 - tu) * (1 - tv) + f10 * tu * (1 - tv) +
+                           f01 * (1 - tu) * tv + f11 * tu * tv)
+
+        # The finest cells were never checked against tol; their lattice points are exact already
+        exact &= (u != np.round(u)) | (v != np.round(v))
+        if exact.any():
+            out[:, exact] = self.store.source.field(x.ravel()[exact], z.ravel()[exact])
+            self.evaluations += int(np.count_nonzero(exact))
+
+        return tuple(values.reshape(grid.shape) for values in out)
+
+
+def refine(source, grid, tol=1e-3, base=8, max_depth=None, min_depth=2):
+    """Build an :class:`AdaptiveField` of ``source`` over the domain of ``grid``.
+
+    The domain starts as ``base x base`` cells. Cells are split while the
+    largest of the Bx, Bz and V interpolation errors at their centre or edge
+    midpoints exceeds ``tol`` (or is not finite), down to ``max_depth``
+    levels, which by default makes the finest cells as small as the grid
+    spacing allows without going below it, so on ``2**k + 1`` point grids
+    the lattice lines up with the grid points. Every cell is split at least
+    ``min_depth`` times.
+    """
+    if max_depth is None:
+        max_depth = max(0, int(np.floor(np.log2(max(grid.nx - 1, grid.nz - 1, 1) / base))))
+    min_depth = min(min_depth, max_depth)
+    size = base * 2 ** max_depth
+    store = _PointStore(source, grid.xmin, (grid.xmax - grid.xmin) / size,
+                        grid.zmin, (grid.zmax - grid.zmin) / size, size)
+
+    a, b = np.meshgrid(np.arange(base), np.arange(base), indexing='ij')
+    cells = np.stack([a.ravel(), b.ravel()], axis=1).astype(np.int64)
+    leaves = []
+
+    for level in range(max_depth + 1):
+        step = 2 ** (max_depth - level)
+        ix, iz = cells[:, 0] * step, cells[:, 1] * step
+        corners = [store.key(ix + di, iz + dj) for di, dj in ((0, 0), (step, 0), (0, step), (step, step))]
+        if level == max_depth or not len(cells):
+            # Leaves at the finest level still need their corners for resampling
+            if len(cells):
+                store.ensure(*corners)
+            leaves.append((level, cells))
+            break
+
+        # Compare the field at the cell centre and edge midpoints with bilinear interpolation from the
+        # corners, evaluating all nine points of the level in one kernel call
+        half = step // 2
+        edges = [store.key(ix + half, iz), store.key(ix + half, iz + step),
+                 store.key(ix, iz + half), store.key(ix + step, iz + half)]
+        center = store.key(ix + half, iz + half)
+        store.ensure(*corners, *edges, center)
+        f00, f10, f01, f11 = (store.lookup(k) for k in corners)
+        predicted = [(f00 + f10) / 2, (f01 + f11) / 2, (f00 + f01) / 2, (f10 + f11) / 2,
+                     (f00 + f10 + f01 + f11) / 4]
+        with np.errstate(invalid='ignore'):
+            error = np.max([np.abs(store.lookup(k) - p).max(axis=0)
+                            for k, p in zip(edges + [center], predicted)], axis=0)
+        split = ~(error <= tol) | (level < min_depth)
+
+        leaves.append((level, cells[~split]))
+        parents = cells[split] * 2
+        cells = np.concatenate([parents + [0, 0], parents + [1, 0], parents + [0, 1], parents + [1, 1]])
+
+    return AdaptiveField(grid.xmin, grid.xmax, grid.zmin, grid.zmax, base, max_depth, leaves,
+                         store.keys.size, store)
@@ -0,0 +1,79 @@
+"""Selection of the implementation behind the hot kernels.
+
+``'numpy'`` is the reference backend: the vectorized code in
+:mod:`magfield.kernels`. ``'numba'`` compiles fused loops (see
+:mod:`magfield._numba`) that compute Bx, Bz and V of each point-source pair
+in one pass, without block temporaries, and spread the points over all
+cores with ``prange``. Numba is optional; the default ``'auto'`` uses it
+when it can be imported and falls back to NumPy otherwise.
+
+The backend is chosen by :func:`set_backend` or, if that was not called,
+by the ``MAGFIELD_BACKEND`` environment variable. Both precisions run on
+the selected backend; the compiled kernels are specialized for float32
+inputs with the same widening of per-source terms as the NumPy ones.
+"""
+
+import os
+import warnings
+
+BACKENDS = ('numpy', 'numba')
+
+_selected = None
+_compiled = None
+
+
+def available(name):
+    """Return whether backend ``name`` can be used in this environment."""
+    if name == 'numpy':
+        return True
+    if name == 'numba':
+        try:
+            import numba  # noqa: F401
+        except ImportError:
+            return False
+        return True
+    raise ValueError(f"unknown backend {name!r}, expected one of {BACKENDS} or 'auto'")
+
+
+def set_backend(name):
+    """Select backend ``name``, or ``'auto'``/None to go back to the environment default."""
+    global _selected
+    if name not in (None, 'auto'):
+        available(name)
+    _selected = None if name == 'auto' else name
+
+
+def get_backend():
+    """Return the name of the backend the kernels currently use."""
+    name = _selected or os.environ.get('MAGFIELD_BACKEND', 'auto')
+    if name == 'auto':
+        return 'numba' if available('numba') else 'numpy'
+    if not available(name):
+        warnings.warn(f"backend {name!r} is not available, falling back to 'numpy'", RuntimeWarning, stacklevel=2)
+        return 'numpy'
+    return name
+
+
+def compiled():
+    """Return the module of compiled kernels, importing (and JIT-compiling) it on first use."""
+    global _compiled
+    if _compiled is None:
+        from . import _numba
+        _compiled = _numba
+    return _compiled
+
+
+def thread_safe():
+    """Return whether the kernels may be called from several threads at once.
+
+    NumPy kernels always may. The compiled kernels may unless Numba runs on
+    its ``workqueue`` threading layer, which is only known after the first
+    parallel call, so this returns False until then.
+    """
+    if get_backend() != 'numba':
+        return True
+    import numba
+    try:
+        return numba.threading_layer() != 'workqueue'
+    except ValueError:
+        return False
@@ -0,0 +1,236 @@
+"""Benchmarks and regression checks for the field kernels.
+
+``python -m magfield.benchmark run --out results.json`` times every kernel
+over a range of grid sizes and charge counts and records wall time,
+throughput and peak memory. ``python -m magfield.benchmark compare
+baseline.json results.json`` flags cases that got slower or use more memory
+than the stored baseline and exits with status 1 if there are any; results
+from a different backend, CPU count or kernel version are refused.
+``python -m magfield.benchmark profile --out profile.json script.py`` runs a
+script with :mod:`magfield.profiling` on and prints where its time went.
+"""
+
+import argparse
+import json
+import os
+import platform
+import runpy
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from . import profiling
+from .backends import BACKENDS, get_backend, set_backend
+from .grid import Grid, evaluate
+from .kernels import KERNEL_VERSION
+from .sources import LineChargePair, Rectangle, RingCharges
+
+# Benchmark cases: name -> (source factory taking num_charges, point-source evaluations per grid point)
+CASES = {
+    'rectangle': (lambda n: Rectangle(), lambda n: 4),
+    'line_pair': (lambda n: LineChargePair(), lambda n: 2),
+    'ring_outer_inner': (lambda n: RingCharges(num_charges=n, layout='outer_inner'), lambda n: 2 * n),
+    'ring_pair': (lambda n: RingCharges(num_charges=n, layout='pair'), lambda n: 2 * n),
+    'ring_side': (lambda n: RingCharges(num_charges=n, layout='side'), lambda n: 2 * n),
+}
+
+# Cases whose cost does not depend on num_charges
+FIXED_CASES = ('rectangle', 'line_pair')
+
+DEFAULT_SIZES = (100, 400, 1000, 2000, 4000)
+DEFAULT_CHARGES = (100, 1000)
+
+# Skip cases above this many point-source evaluations unless the budget is raised
+DEFAULT_BUDGET = 2e9
+
+# Machine fields that must match for timings to be comparable, besides the kernel version
+COMPARABLE_MACHINE = ('backend', 'cpu_count')
+
+
+def machine_info():
+    """Describe the machine and software a benchmark ran on."""
+    return {'platform': platform.platform(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'cpu_count': os.cpu_count(), 'backend': get_backend()}
+
+
+def measure(source, grid, repeat=3):
+    """Return ``(best wall seconds, peak traced bytes)`` of evaluating ``source`` on ``grid``.
+
+    An untimed evaluation on a few points first loads or compiles the kernels
+    of the backend, so even ``repeat=1`` times only the evaluation.
+    """
+    evaluate(source, Grid(grid.xmin, grid.xmax, 2, grid.zmin, grid.zmax, 2))
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        evaluate(source, grid)
+        best = min(best, time.perf_counter() - start)
+
+    # Memory is traced in a separate run so tracing does not skew the timings
+    tracemalloc.start()
+    try:
+        evaluate(source, grid)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run(cases=None, sizes=DEFAULT_SIZES, charges=DEFAULT_CHARGES, repeat=3, budget=DEFAULT_BUDGET, log=None):
+    """Benchmark ``cases`` (all by default) and return the results as a JSON-able dict."""
+    results = []
+    for name in cases or CASES:
+        make, per_point = CASES[name]
+        for num_charges in (charges[:1] if name in FIXED_CASES else charges):
+            for size in sizes:
+                points = size * size
+                evaluations = points * per_point(num_charges)
+                row = {'case': name, 'size': size, 'num_charges': None if name in FIXED_CASES else num_charges,
+                       'points': points, 'evaluations': evaluations}
+                if evaluations > budget:
+                    row['skipped'] = f'over the --budget of {budget:.3g} evaluations'
+                else:
+                    seconds, peak = measure(make(num_charges), Grid(-15, 15, size, -15, 15, size), repeat)
+                    row.update(seconds=seconds, throughput=evaluations / seconds, peak_bytes=peak)
+                results.append(row)
+                if log is not None:
+                    log(format_row(row))
+    return {'kernel_version': KERNEL_VERSION, 'machine': machine_info(), 'results': results}
+
+
+def format_row(row):
+    label = f"{row['case']:<17} {row['size']:>5}^2 {row['num_charges'] or '':>6}"
+    if 'skipped' in row:
+        return f"{label}  skipped ({row['skipped']})"
+    return (f"{label} {row['seconds']:>10.4f} s {row['throughput']:>10.3g} eval/s "
+            f"{row['peak_bytes'] / 2 ** 20:>9.1f} MiB")
+
+
+def mismatches(baseline, current):
+    """Return ``{field: (baseline value, current value)}`` for the settings that differ between two results."""
+    fields = {'kernel_version': (baseline.get('kernel_version'), current.get('kernel_version'))}
+    for name in COMPARABLE_MACHINE:
+        fields[name] = (baseline['machine'].get(name), current['machine'].get(name))
+    return {name: values for name, values in fields.items() if values[0] != values[1]}
+
+
+def _describe(different):
+    return ', '.join(f'{name} {old!r} vs {new!r}' for name, (old, new) in different.items())
+
+
+def compare(baseline, current, time_threshold=0.2, memory_threshold=0.2, force=False):
+    """Return ``(rows, regressions)`` comparing matching cases of two benchmark results.
+
+    A case regresses when its time or peak memory grew by more than the
+    relative threshold. Results from a different backend, CPU count or
+    kernel version raise ``ValueError`` unless ``force`` is set, in which
+    case every row is marked ``'mismatched'``.
+    """
+    def key(row):
+        return row['case'], row['size'], row['num_charges']
+
+    different = mismatches(baseline, current)
+    if different and not force:
+        raise ValueError(f'results are not comparable: {_describe(different)}')
+
+    old = {key(row): row for row in baseline['results'] if 'skipped' not in row}
+    rows, regressions = [], []
+    for row in current['results']:
+        if 'skipped' in row or key(row) not in old:
+            continue
+        ref = old[key(row)]
+        entry = {'case': row['case'], 'size': row['size'], 'num_charges': row['num_charges'],
+                 'time_ratio': row['seconds'] / ref['seconds'],
+                 'memory_ratio': row['peak_bytes'] / max(ref['peak_bytes'], 1)}
+        entry['regressed'] = (entry['time_ratio'] > 1 + time_threshold or
+                              entry['memory_ratio'] > 1 + memory_threshold)
+        entry['mismatched'] = bool(different)
+        rows.append(entry)
+        if entry['regressed']:
+            regressions.append(entry)
+    return rows, regressions
+
+
+def profile_script(script, script_args=(), out='profile.json', cprofile=None, memory=True):
+    """Run ``script`` as __main__ under :func:`magfield.profiling.profiled` and print its report."""
+    sys.argv = [script, *script_args]
+    with profiling.profiled(out, cprofile, memory) as recorder:
+        runpy.run_path(script, run_name='__main__')
+    report = recorder.report()
+    print(f"wall {report['wall']:.3f} s, cpu {report['cpu']:.3f} s, peak {report['peak_bytes'] or 0:,} bytes")
+    for name, stats in sorted(report['stages'].items(), key=lambda item: -item[1]['wall']):
+        print(f"{name:<24} {stats['calls']:>6} calls {stats['wall']:>9.4f} s wall {stats['cpu']:>9.4f} s cpu "
+              f"{stats['peak_bytes']:>14,} bytes")
+    for name, value in sorted(report['counters'].items()):
+        print(f"{name:<40} {value:>16,}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--out', help='write the results to this JSON file')
+    run_parser.add_argument('--cases', nargs='+', choices=sorted(CASES))
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    run_parser.add_argument('--charges', type=int, nargs='+', default=DEFAULT_CHARGES)
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                            help='skip cases above this many point-source evaluations')
+    run_parser.add_argument('--backend', choices=BACKENDS + ('auto',), default='auto')
+
+    compare_parser = commands.add_parser('compare', help='compare results against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--time-threshold', type=float, default=0.2)
+    compare_parser.add_argument('--memory-threshold', type=float, default=0.2)
+    compare_parser.add_argument('--force', action='store_true',
+                                help='compare results from a different backend, CPU count or kernel version')
+
+    profile_parser = commands.add_parser('profile', help='run a script with profiling on')
+    profile_parser.add_argument('script')
+    profile_parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments passed to the script')
+    profile_parser.add_argument('--out', default='profile.json', help='write the JSON report to this file')
+    profile_parser.add_argument('--cprofile', help='also write cProfile stats to this file')
+    profile_parser.add_argument('--no-memory', dest='memory', action='store_false', help='do not trace memory')
+
+    args = parser.parse_args(argv)
+    if args.command == 'profile':
+        return profile_script(args.script, args.args, args.out, args.cprofile, args.memory)
+    if args.command == 'run':
+        set_backend(args.backend)
+        results = run(args.cases, args.sizes, args.charges, args.repeat, args.budget, log=print)
+        skipped = sum('skipped' in row for row in results['results'])
+        if skipped:
+            print(f"{skipped} case(s) skipped over the budget of {args.budget:.3g} evaluations; "
+                  f"raise --budget to run them")
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    different = mismatches(baseline, current)
+    if different and not args.force:
+        print(f'results are not comparable: {_describe(different)}; use --force to compare anyway')
+        return 2
+    if different:
+        print(f'warning: comparing across {_describe(different)}')
+    rows, regressions = compare(baseline, current, args.time_threshold, args.memory_threshold, args.force)
+    for row in rows:
+        flag = ' '.join(filter(None, ['REGRESSION' if row['regressed'] else '',
+                                      '(mismatched)' if row['mismatched'] else '']))
+        print(f"{row['case']:<17} {row['size']:>5}^2 {row['num_charges'] or '':>6} "
+              f"time x{row['time_ratio']:.2f} memory x{row['memory_ratio']:.2f} {flag}")
+    print(f"{len(regressions)} regression(s) in {len(rows)} case(s)")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Content-addressed on-disk cache of computed fields.
+
+Each entry is a directory named by a hash of the source parameters, the
+grid and :data:`magfield.kernels.KERNEL_VERSION`, holding ``Bx.npy``,
+``Bz.npy``, ``V.npy`` and ``meta.json``. Entries are reloaded memory-mapped
+and evicted least-recently-used once the cache exceeds its size cap.
+"""
+
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from . import profiling
+from .grid import evaluate
+from .kernels import KERNEL_VERSION
+
+# Names of the cached arrays, in the order fields are returned
+FIELD_NAMES = ('Bx', 'Bz', 'V')
+
+# Default size cap of the cache, in bytes
+DEFAULT_MAX_BYTES = 2 ** 30
+
+
+def default_directory():
+    """Return ``$MAGFIELD_CACHE_DIR``, or ``~/.cache/magfield`` when it is unset."""
+    return os.environ.get('MAGFIELD_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'magfield')
+
+
+def _identify(value):
+    if dataclasses.is_dataclass(value):
+        return describe(value)
+    if isinstance(value, (tuple, list)):
+        return [_identify(v) for v in value]
+    if isinstance(value, np.ndarray):
+        # Large arrays, such as the charges of PointCharges, are identified by their contents
+        return {'shape': list(value.shape), 'dtype': value.dtype.str,
+                'sha256': hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()}
+    return value
+
+
+def describe(obj):
+    """Return the JSON-able parameters that identify a source or grid dataclass."""
+    params = {f.name: _identify(getattr(obj, f.name)) for f in dataclasses.fields(obj) if f.compare}
+    return {'type': type(obj).__name__, 'params': params}
+
+
+def cache_key(source, grid):
+    """Hash the source parameters, grid spec and kernel version into a cache key."""
+    spec = {'source': describe(source), 'grid': describe(grid), 'kernel': KERNEL_VERSION}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+class FieldCache:
+    """On-disk field cache with a size cap and LRU eviction."""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    @profiling.timed('cache.read')
+    def get(self, source, grid):
+        """Return the cached ``(Bx, Bz, V)`` as read-only memmaps, or None on a miss."""
+        path = self._path(cache_key(source, grid))
+        try:
+            fields = tuple(np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in FIELD_NAMES)
+            # Mark the entry as recently used
+            os.utime(os.path.join(path, 'meta.json'))
+        except FileNotFoundError:
+            return None
+        return fields
+
+    @profiling.timed('cache.write')
+    def put(self, source, grid, fields):
+        """Store ``(Bx, Bz, V)`` for ``source`` on ``grid`` and evict old entries over the cap."""
+        key = cache_key(source, grid)
+        path = self._path(key)
+        tmp = tempfile.mkdtemp(prefix=f'.{key}-', dir=self.directory)
+        try:
+            for name, values in zip(FIELD_NAMES, fields):
+                np.save(os.path.join(tmp, f'{name}.npy'), np.asarray(values))
+            meta = {'source': describe(source), 'grid': describe(grid), 'kernel': KERNEL_VERSION}
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(meta, f, sort_keys=True)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # Another process stored the same entry first
+                shutil.rmtree(tmp, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+
+    def evaluate(self, source, grid, compute=evaluate):
+        """Return the cached field of ``source`` on ``grid``, computing and storing it on a miss."""
+        fields = self.get(source, grid)
+        if fields is None:
+            self.put(source, grid, compute(source, grid))
+            fields = self.get(source, grid)
+        return fields
+
+    def entries(self):
+        """Return ``(last_used, nbytes, key)`` for every entry, oldest first."""
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                last_used = os.path.getmtime(os.path.join(path, 'meta.json'))
+                nbytes = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            except FileNotFoundError:
+                continue
+            entries.append((last_used, nbytes, key))
+        return sorted(entries)
+
+    def size(self):
+        """Return the total size of the cached entries in bytes."""
+        return sum(nbytes for _, nbytes, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Delete least-recently-used entries until the cache fits ``max_bytes``.
+
+        The entry ``keep`` is never evicted, even if it alone exceeds the cap.
+        """
+        entries = self.entries()
+        total = sum(nbytes for _, nbytes, _ in entries)
+        for _, nbytes, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= nbytes
+
+    def clear(self):
+        """Delete every entry."""
+        for _, _, key in self.entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+
+def cached_evaluate(source, grid, cache=None):
+    """Evaluate ``source`` on ``grid`` through ``cache`` (a default :class:`FieldCache` if None)."""
+    if cache is None:
+        cache = FieldCache()
+    return cache.evaluate(source, grid)
@@ -0,0 +1,168 @@
+"""FFT convolution solver for charge-density and magnetization rasters.
+
+The kernels of :func:`magfield.kernels.charge_sum` only depend on the offset
+between point and charge, so the field of any charge density ``rho`` on a
+regular grid is a convolution with ``log r``, ``dz / r**2`` and
+``dx / r**2``. :class:`ConvolutionSolver` treats the raster as constant on
+each grid cell, integrates the kernels over a cell in closed form (so the
+cell under the point needs no special treatment), and convolves with
+zero-padded FFTs in O(N log N); the padding to twice the grid keeps the
+periodic images out of the result.
+
+A magnetization raster ``(mx, mz)`` is the density ``rho = div M`` of the
+scripts' convention (magnetization along +z puts the positive charge on the
+bottom face, like the ring and line-pair scripts). It is convolved with the
+kernel derivatives directly, so no finite differences of ``M`` are taken::
+
+    solver = ConvolutionSolver(grid)
+    Bx, Bz, V = solver.magnetization(mz=magnetization * coverage(grid, inside))
+"""
+
+import numpy as np
+
+from .grid import Grid
+from .kernels import rectangle_field
+from .sources import AnalyticRing, PointCharges
+
+# Antiderivatives P(u, v) with d2P/du dv equal to a kernel of the offset (u, v) = (dx, dz).
+# Cell corners never coincide with grid points, so u and v are never 0 here.
+KERNELS = {
+    'log': lambda u, v: (u * v * (0.5 * np.log(u ** 2 + v ** 2) - 1.5) +
+                         0.5 * u ** 2 * np.arctan(v / u) + 0.5 * v ** 2 * np.arctan(u / v)),
+    'u': lambda u, v: 0.5 * v * np.log(u ** 2 + v ** 2) - v + u * np.arctan(v / u),
+    'v': lambda u, v: 0.5 * u * np.log(u ** 2 + v ** 2) - u + v * np.arctan(u / v),
+    'uu': lambda u, v: np.arctan(v / u),
+    'uv': lambda u, v: 0.5 * np.log(u ** 2 + v ** 2),
+    'vv': lambda u, v: np.arctan(u / v),
+}
+
+
+def coverage(grid, inside, oversample=8):
+    """Return the fraction of each grid cell for which ``inside(x, z)`` is true.
+
+    Each cell is sampled at ``oversample**2`` points, which anti-aliases the
+    outline of a magnet; the result can be scaled into a density or a
+    magnetization raster.
+    """
+    dx, dz = ConvolutionSolver(grid).spacing
+    x, z = grid.points()
+    offsets = (np.arange(oversample) + 0.5) / oversample - 0.5
+    fraction = np.zeros(grid.shape)
+    for ox in offsets:
+        for oz in offsets:
+            fraction += inside(x + ox * dx, z + oz * dz)
+    return fraction / oversample ** 2
+
+
+class ConvolutionSolver:
+    """Solve for ``(Bx, Bz, V)`` of rasters on ``grid``.
+
+    Rasters have the grid's shape ``(nx, nz)``, optionally with leading batch
+    axes, and the outputs take the same shape. The kernel spectra are
+    computed once per solver and reused for every raster.
+    """
+
+    def __init__(self, grid):
+        if min(grid.shape) < 2:
+            raise ValueError("the convolution grid needs at least 2 points along each axis")
+        self.grid = grid
+        self.padded = (2 * grid.nx, 2 * grid.nz)
+        self._spectra = {}
+
+    @property
+    def spacing(self):
+        grid = self.grid
+        return (grid.xmax - grid.xmin) / (grid.nx - 1), (grid.zmax - grid.zmin) / (grid.nz - 1)
+
+    def spectrum(self, name):
+        """Return the FFT of the cell-integrated kernel ``name`` of :data:`KERNELS`."""
+        if name not in self._spectra:
+            dx, dz = self.spacing
+            # Offsets in FFT order, so negative offsets wrap to the end of the padded array
+            u = np.fft.fftfreq(self.padded[0], 1 / self.padded[0])[:, None] * dx
+            v = np.fft.fftfreq(self.padded[1], 1 / self.padded[1])[None, :] * dz
+            P = KERNELS[name]
+            table = (P(u + dx / 2, v + dz / 2) - P(u - dx / 2, v + dz / 2) -
+                     P(u + dx / 2, v - dz / 2) + P(u - dx / 2, v - dz / 2))
+            self._spectra[name] = np.fft.rfft2(table)
+        return self._spectra[name]
+
+    def _transform(self, raster):
+        raster = np.asarray(raster, dtype=float)
+        if raster.shape[-2:] != self.grid.shape:
+            raise ValueError(f"raster of shape {raster.shape} does not match the grid {self.grid.shape}")
+        return np.fft.rfft2(raster, s=self.padded)
+
+    def _convolve(self, terms):
+        # Sum of raster spectra times kernel spectra, back on the unpadded grid
+        total = sum(transformed * self.spectrum(name) for transformed, name in terms)
+        return np.fft.irfft2(total, s=self.padded)[..., :self.grid.nx, :self.grid.nz]
+
+    def density(self, rho):
+        """Return ``(Bx, Bz, V)`` of the charge density ``rho`` (charge per unit area)."""
+        transformed = self._transform(rho)
+        return (self._convolve([(transformed, 'v')]), self._convolve([(transformed, 'u')]),
+                self._convolve([(transformed, 'log')]))
+
+    def magnetization(self, mx=0.0, mz=0.0):
+        """Return ``(Bx, Bz, V)`` of the magnetization raster ``(mx, mz)``; either or both may be 0."""
+        # V = M . grad(log r) convolved over the magnet; Bx and Bz are its z and x derivatives
+        parts = [(self._transform(m), axis) for m, axis in ((mx, 'u'), (mz, 'v')) if np.any(m)]
+        if not parts:
+            shape = np.broadcast_shapes(np.shape(mx), np.shape(mz), self.grid.shape)
+            return np.zeros(shape), np.zeros(shape), np.zeros(shape)
+        second = {('u', 'z'): 'uv', ('v', 'z'): 'vv', ('u', 'x'): 'uu', ('v', 'x'): 'uv'}
+        return (self._convolve([(t, second[axis, 'z']) for t, axis in parts]),
+                self._convolve([(t, second[axis, 'x']) for t, axis in parts]),
+                self._convolve([(t, axis) for t, axis in parts]))
+
+
+def _relative_errors(fields, reference, keep):
+    return {name: float(np.abs(f - r)[keep].max() / np.abs(r)[keep].max())
+            for name, f, r in zip(('Bx', 'Bz', 'V'), fields, reference)}
+
+
+def validate(grid=None, oversample=8, margin=3, faces=4000):
+    """Check the solver against the ring and rectangle kernels and return the relative errors.
+
+    ``'ring'`` rasterizes the 'pair' annulus rings of :class:`AnalyticRing`
+    as a density. ``'rectangle'`` rasterizes the magnet of the rectangle
+    scripts as a uniform z magnetization and compares it with ``faces``
+    line charges per face summed directly; ``'rectangle_corners'`` compares
+    its Bz with :func:`magfield.kernels.rectangle_field`'s V, the corner sum
+    ``sum +-log r`` that is the cell integral of ``d2 log r / dx dz`` over
+    the magnet. Points within ``margin`` cells of a magnet outline are
+    skipped, since the raster only resolves the outline to a cell.
+    """
+    grid = grid if grid is not None else Grid(-15, 15, 301, -15, 15, 301)
+    solver = ConvolutionSolver(grid)
+    x, z = np.broadcast_arrays(*grid.points())
+    step = max(solver.spacing) * margin
+    errors = {}
+
+    ring = AnalyticRing(outer_radius=5.0, inner_radius=3.0, layout='pair', profile='annulus')
+    rho = np.zeros(grid.shape)
+    keep = np.ones(grid.shape, dtype=bool)
+    for center_z, weight in ((-ring.height / 2, ring.magnetization), (ring.height / 2, -ring.magnetization)):
+        def annulus(px, pz):
+            rho2 = px ** 2 + (pz - center_z) ** 2
+            return (rho2 < ring.outer_radius ** 2) & (rho2 >= ring.inner_radius ** 2)
+        area = np.pi * (ring.outer_radius ** 2 - ring.inner_radius ** 2)
+        rho += weight / area * coverage(grid, annulus, oversample)
+        radius = np.hypot(x, z - center_z)
+        keep &= (np.abs(radius - ring.outer_radius) > step) & (np.abs(radius - ring.inner_radius) > step)
+    errors['ring'] = _relative_errors(solver.density(rho), ring.field(x, z), keep)
+
+    length, height, magnetization = 10.0, 4.0, 1.0
+    mz = magnetization * coverage(grid, lambda px, pz: (np.abs(px) < length / 2) & (np.abs(pz) < height / 2),
+                                  oversample)
+    fields = solver.magnetization(mz=mz)
+    keep = ~((np.abs(x) < length / 2 + step) & (np.abs(np.abs(z) - height / 2) < step) |
+             (np.abs(np.abs(x) - length / 2) < step) & (np.abs(z) < height / 2 + step))
+    charge_x = np.tile((np.arange(faces) + 0.5) / faces * length - length / 2, 2)
+    charge_z = np.repeat([-height / 2, height / 2], faces)
+    weight = np.repeat([magnetization, -magnetization], faces) * length / faces
+    errors['rectangle'] = _relative_errors(fields, PointCharges(charge_x, charge_z, weight).field(x, z), keep)
+    corner_v = rectangle_field(x, z, length, height, magnetization)[2]
+    errors['rectangle_corners'] = {'Bz': float(np.abs(fields[1] - corner_v)[keep].max() / np.abs(corner_v)[keep].max())}
+    return errors
@@ -0,0 +1,208 @@
+"""Interactive geometry explorer with progressive refinement.
+
+Sliders change geometry fields of a source. Each change renders a coarse
+preview at once, then a background thread refines the potential map level
+by level; a newer slider position cancels the refinement in progress. The
+figure's artists are updated in place (``QuadMesh.set_array``,
+``Quiver.set_UVC``) instead of being redrawn from scratch.
+"""
+
+import contextlib
+import dataclasses
+import queue
+import threading
+
+import numpy as np
+
+from . import backends
+from .grid import Grid
+from .parallel import tiles
+from .plotting import _pyplot
+
+# Geometry fields offered as sliders when present in the source
+GEOMETRY_FIELDS = ('length', 'height', 'outer_radius', 'inner_radius', 'magnetization')
+
+# Default slider span around the current value, as a fraction of it, and its smallest half-width
+SLIDER_SPAN = 0.75
+MIN_SLIDER_HALF_WIDTH = 0.5
+
+
+def default_range(value):
+    """Return the default ``(min, max)`` slider limits around ``value``, also for zero or negative values."""
+    half = max(SLIDER_SPAN * abs(value), MIN_SLIDER_HALF_WIDTH)
+    return value - half, value + half
+
+
+class Cancelled(Exception):
+    """Raised inside a refinement job that a newer slider position made stale."""
+
+
+def _coarsen(grid, factor):
+    return Grid(grid.xmin, grid.xmax, max(2, grid.nx // factor), grid.zmin, grid.zmax, max(2, grid.nz // factor))
+
+
+def _upsample(values, shape):
+    # Nearest-neighbour resampling of a coarse level onto the display grid
+    i = np.round(np.linspace(0, values.shape[0] - 1, shape[0])).astype(int)
+    j = np.round(np.linspace(0, values.shape[1] - 1, shape[1])).astype(int)
+    return values[np.ix_(i, j)]
+
+
+class Explorer:
+    """Slider-driven view of the potential and field of ``source`` on ``grid``.
+
+    ``params`` names the source fields to expose (by default the geometry
+    fields it has) and ``ranges`` maps them to ``(min, max)`` slider limits,
+    by default :func:`default_range` of the current values.
+    ``levels`` are the decimation factors rendered in turn, coarsest first;
+    the first one is computed synchronously as the preview. Field arrows are
+    drawn on an ``arrows`` x ``arrows`` grid.
+    """
+
+    def __init__(self, source, grid=None, params=None, ranges=None, levels=(8, 4, 2, 1), arrows=20,
+                 tile=64, poll_ms=30):
+        self.source = source
+        self.grid = grid or Grid()
+        names = {f.name for f in dataclasses.fields(source)}
+        self.params = list(params or [name for name in GEOMETRY_FIELDS if name in names])
+        self.ranges = {name: default_range(getattr(source, name)) for name in self.params}
+        self.ranges.update(ranges or {})
+        self.levels = levels
+        self.arrow_grid = Grid(self.grid.xmin, self.grid.xmax, arrows, self.grid.zmin, self.grid.zmax, arrows)
+        self.tile = tile
+        self.poll_ms = poll_ms
+
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._kernel_lock = threading.Lock()
+        self._results = queue.Queue()
+        self._worker = None
+        self.level = None
+
+    def _field(self, source, x, z):
+        # Serialize kernel calls of the two threads when the compiled backend cannot run them concurrently
+        with contextlib.nullcontext() if backends.thread_safe() else self._kernel_lock:
+            return source.field(x, z)
+
+    def build(self):
+        """Create the figure, artists and sliders and return the figure."""
+        plt = _pyplot()
+        from matplotlib.widgets import Slider
+
+        self.fig, self.ax = plt.subplots()
+        self.fig.subplots_adjust(bottom=0.1 + 0.05 * len(self.params))
+        x, z = self.grid.x, self.grid.z
+        self.mesh = self.ax.pcolormesh(x, z, np.zeros(self.grid.shape).T, cmap='coolwarm', shading='auto')
+        self.fig.colorbar(self.mesh, ax=self.ax, label='Magnetic Potential')
+        ax_, az_ = self.arrow_grid.meshgrid()
+        # The first kernel call happens here on the main thread: Numba's threading layer hangs at exit
+        # if the refinement thread starts it
+        Bx, Bz, _ = self._field(self.source, *self.arrow_grid.points())
+        self.quiver = self.ax.quiver(ax_, az_, Bx.T, Bz.T, color='k', pivot='middle')
+        self.ax.set_xlabel('x')
+        self.ax.set_ylabel('z')
+
+        self.sliders = {}
+        for k, name in enumerate(self.params):
+            slider_ax = self.fig.add_axes([0.2, 0.02 + 0.05 * k, 0.6, 0.03])
+            lo, hi = self.ranges[name]
+            slider = Slider(slider_ax, name, lo, hi, valinit=getattr(self.source, name))
+            slider.on_changed(lambda value, name=name: self.set_param(name, value))
+            self.sliders[name] = slider
+
+        self.timer = self.fig.canvas.new_timer(interval=self.poll_ms)
+        self.timer.add_callback(self.poll)
+        self.timer.start()
+        self.refresh()
+        return self.fig
+
+    def set_param(self, name, value):
+        """Change one source field and re-render.
+
+        A geometry the source rejects (such as an annulus with
+        ``inner_radius >= outer_radius``) keeps the last valid one on screen
+        and shows the error as the title.
+        """
+        previous = self.source
+        self.source = dataclasses.replace(self.source, **{name: value})
+        try:
+            self.refresh()
+        except ValueError as error:
+            self.source = previous
+            self.ax.set_title(f"{name} = {value:.3g}: {error}", color='r')
+            self.fig.canvas.draw_idle()
+            return
+        self.ax.set_title('')
+
+    def refresh(self):
+        """Render the coarse preview now and start refining it in the background."""
+        # Arrows and the coarsest level are cheap enough to compute right away; the view and the
+        # refinement in progress are left alone if the source raises here
+        Bx, Bz, _ = self._field(self.source, *self.arrow_grid.points())
+        coarse = _coarsen(self.grid, self.levels[0])
+        V = self._field(self.source, *coarse.points())[2]
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+
+        self.quiver.set_UVC(Bx.T, Bz.T)
+        self._show_level(self.levels[0], V)
+        self.fig.canvas.draw_idle()
+
+        if len(self.levels) > 1:
+            self._worker = threading.Thread(target=self._refine, args=(generation, self.source), daemon=True)
+            self._worker.start()
+
+    def _check(self, generation):
+        if generation != self._generation:
+            raise Cancelled
+
+    def _refine(self, generation, source):
+        try:
+            for factor in self.levels[1:]:
+                level = _coarsen(self.grid, factor)
+                V = np.empty(level.shape)
+                x, z = level.x, level.z
+                for si, sj in tiles(level.shape, self.tile):
+                    self._check(generation)
+                    V[si, sj] = self._field(source, x[si, None], z[None, sj])[2]
+                self._check(generation)
+                self._results.put((generation, factor, V))
+        except Cancelled:
+            pass
+
+    def poll(self):
+        """Apply finished refinement levels of the current job (called by the figure timer)."""
+        updated = False
+        while True:
+            try:
+                generation, factor, V = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self._generation:
+                self._show_level(factor, V)
+                updated = True
+        if updated:
+            self.fig.canvas.draw_idle()
+
+    def _show_level(self, factor, V):
+        values = _upsample(V, self.grid.shape)
+        self.mesh.set_array(values.T)
+        finite = values[np.isfinite(values)]
+        if finite.size:
+            lo, hi = np.percentile(finite, [1, 99])
+            self.mesh.set_clim(lo, hi if hi > lo else lo + 1)
+        self.level = factor
+
+    def show(self):
+        """Build the figure if needed and show it."""
+        if not hasattr(self, 'fig'):
+            self.build()
+        _pyplot().show()
+
+
+def explore(source, grid=None, **options):
+    """Open an :class:`Explorer` for ``source`` and return it."""
+    explorer = Explorer(source, grid, **options)
+    explorer.show()
+    return explorer
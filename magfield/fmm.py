@@ -0,0 +1,244 @@
+"""Fast multipole evaluation of large line-charge sums.
+
+The ring kernels are derivatives of the complex potential
+``phi(w) = sum q log(w - c)`` with ``w = x + i z``: ``V = Re phi``,
+``Bz = Re phi'`` and ``Bx = -Im phi'``. :func:`fmm_charge_sum` evaluates it
+with the 2-D fast multipole method (Greengard & Rokhlin) on a uniform
+quadtree: multipole expansions of order ``p`` are translated up the tree,
+converted to local expansions between well-separated boxes and shifted back
+down, and only neighbouring leaf boxes are summed directly. The cost is
+O(N + M) in the number of charges and points; ``tol`` sets ``p``.
+"""
+
+from math import comb
+
+import numpy as np
+
+from .kernels import DEFAULT_MAX_PAIRS, charge_sum
+
+# Default target number of charges per leaf box
+DEFAULT_LEAF_SIZE = 32
+
+# Default accuracy of the expansions
+DEFAULT_TOL = 1e-6
+
+
+def expansion_order(tol):
+    """Return the expansion order that reaches relative accuracy ``tol``.
+
+    Well-separated boxes of the uniform tree converge at least like ``2**-p``.
+    """
+    return max(2, int(np.ceil(-np.log2(tol))))
+
+
+def _m2m(d, p):
+    # Shift a multipole expansion by d = child centre - parent centre
+    T = np.zeros((p + 1, p + 1), dtype=complex)
+    T[0, 0] = 1
+    for l in range(1, p + 1):
+        T[0, l] = -d ** l / l
+        for k in range(1, l + 1):
+            T[k, l] = comb(l - 1, k - 1) * d ** (l - k)
+    return T
+
+
+def _m2l(d, p):
+    # Convert a multipole expansion about d (relative to the local centre) into a local expansion
+    T = np.zeros((p + 1, p + 1), dtype=complex)
+    k = np.arange(1, p + 1)
+    T[0, 0] = np.log(-d)
+    T[1:, 0] = (-1) ** k / d ** k
+    for l in range(1, p + 1):
+        T[0, l] = -1 / (l * d ** l)
+        T[1:, l] = (-1) ** k * np.array([comb(l + kk - 1, kk - 1) for kk in k]) / d ** (k + l)
+    return T
+
+
+def _l2l(d, p):
+    # Shift a local expansion by d = child centre - parent centre
+    T = np.zeros((p + 1, p + 1), dtype=complex)
+    for k in range(p + 1):
+        for l in range(k + 1):
+            T[k, l] = comb(k, l) * d ** (k - l)
+    return T
+
+
+def _near_field(tx, tz, tbox, sx, sz, sq, sbox, n, max_pairs):
+    # Direct sum over the charges in each target's leaf box and its eight neighbours
+    order = np.argsort(sbox, kind='stable')
+    sx, sz, sq, sbox = sx[order], sz[order], sq[order], sbox[order]
+    starts = np.searchsorted(sbox, np.arange(n * n))
+    stops = np.searchsorted(sbox, np.arange(n * n), side='right')
+
+    Bx = np.zeros(tx.size)
+    Bz = np.zeros(tx.size)
+    V = np.zeros(tx.size)
+    bi, bj = np.divmod(tbox, n)
+    for oi in (-1, 0, 1):
+        for oj in (-1, 0, 1):
+            ni, nj = bi + oi, bj + oj
+            valid = (ni >= 0) & (ni < n) & (nj >= 0) & (nj < n)
+            nb = np.where(valid, ni * n + nj, 0)
+            first = np.where(valid, starts[nb], 0)
+            count = np.where(valid, stops[nb] - starts[nb], 0)
+            ends = np.cumsum(count)
+
+            # Process the (target, charge) pairs in bounded blocks of targets
+            t0 = 0
+            while t0 < tx.size:
+                base = ends[t0 - 1] if t0 else 0
+                t1 = max(t0 + 1, int(np.searchsorted(ends, base + max_pairs, side='right')))
+                t1 = min(t1, tx.size)
+                c = count[t0:t1]
+                total = int(c.sum())
+                if total:
+                    target = np.repeat(np.arange(t0, t1), c)
+                    offsets = np.arange(total) - np.repeat(np.cumsum(c) - c, c)
+                    source = np.repeat(first[t0:t1], c) + offsets
+                    dx = tx[target] - sx[source]
+                    dz = tz[target] - sz[source]
+                    r2 = dx ** 2 + dz ** 2
+                    q = sq[source]
+                    Bx += np.bincount(target, q * dz / r2, minlength=tx.size)
+                    Bz += np.bincount(target, q * dx / r2, minlength=tx.size)
+                    V += np.bincount(target, q * 0.5 * np.log(r2), minlength=tx.size)
+                t0 = t1
+    return Bx, Bz, V
+
+
+def fmm_charge_sum(px, pz, charge_x, charge_z, weight, tol=DEFAULT_TOL, leaf_size=DEFAULT_LEAF_SIZE,
+                   order=None, max_pairs=DEFAULT_MAX_PAIRS):
+    """Sum the field of line charges at the points (px, pz) with the fast multipole method.
+
+    Same conventions and result as :func:`magfield.kernels.charge_sum` without
+    ``num_x``/``num_z``, to a relative accuracy of about ``tol``. ``order``
+    overrides the expansion order derived from ``tol``; ``leaf_size`` is the
+    average number of charges or points per leaf box.
+    """
+    px, pz = np.broadcast_arrays(np.asarray(px, dtype=float), np.asarray(pz, dtype=float))
+    shape = px.shape
+    tx, tz = px.ravel(), pz.ravel()
+    sx, sz, sq = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (charge_x, charge_z, weight)))
+    if sx.ndim != 1:
+        raise ValueError("fmm_charge_sum takes one configuration of charges as 1-D arrays")
+    p = expansion_order(tol) if order is None else order
+    if not tx.size or not sx.size:
+        return tuple(np.zeros(shape) for _ in range(3))
+
+    # Map everything into the unit square
+    x0 = min(tx.min(), sx.min())
+    z0 = min(tz.min(), sz.min())
+    size = max(tx.max() - x0, sx.max() - x0, tz.max() - z0, sz.max() - z0) * (1 + 1e-9) or 1.0
+    levels = int(np.clip(np.ceil(np.log(max(tx.size, sx.size) / leaf_size) / np.log(4)), 2, 10))
+    n = 2 ** levels
+
+    def leaf_index(x, z):
+        i = np.minimum(((x - x0) / size * n).astype(np.int64), n - 1)
+        j = np.minimum(((z - z0) / size * n).astype(np.int64), n - 1)
+        return i, j
+
+    si, sj = leaf_index(sx, sz)
+    ti, tj = leaf_index(tx, tz)
+    h = 1 / n
+    ws = ((sx - x0) / size - (si + 0.5) * h) + 1j * ((sz - z0) / size - (sj + 0.5) * h)
+
+    # Multipole expansions of the leaf boxes
+    sbox = si * n + sj
+    multipole = [None] * (levels + 1)
+    M = np.zeros((n * n, p + 1), dtype=complex)
+    M[:, 0] = np.bincount(sbox, sq, minlength=n * n)
+    power = np.ones_like(ws)
+    for k in range(1, p + 1):
+        power = power * ws
+        term = -sq * power / k
+        M[:, k] = np.bincount(sbox, term.real, minlength=n * n) + 1j * np.bincount(sbox, term.imag, minlength=n * n)
+    multipole[levels] = M.reshape(n, n, p + 1)
+
+    # Upward pass: shift the children's expansions to their parents
+    for level in range(levels, 0, -1):
+        child = multipole[level]
+        m = child.shape[0] // 2
+        hc = 1 / 2 ** level
+        parent = np.zeros((m, m, p + 1), dtype=complex)
+        for a in (0, 1):
+            for b in (0, 1):
+                d = (a - 0.5) * hc + 1j * (b - 0.5) * hc
+                parent += child[a::2, b::2] @ _m2m(d, p)
+        multipole[level - 1] = parent
+
+    # Interaction lists and downward pass
+    local = np.zeros((2, 2, p + 1), dtype=complex)
+    for level in range(2, levels + 1):
+        m = 2 ** level
+        hl = 1 / m
+        parent_local = local
+        local = np.zeros((m, m, p + 1), dtype=complex)
+        for a in (0, 1):
+            for b in (0, 1):
+                d = (a - 0.5) * hl + 1j * (b - 0.5) * hl
+                local[a::2, b::2] += parent_local @ _l2l(d, p)
+
+        M = multipole[level]
+        for a in (0, 1):
+            for b in (0, 1):
+                # Children of the parent's neighbours that are not neighbours themselves
+                for oi in range(-2 - a, 4 - a):
+                    for oj in range(-2 - b, 4 - b):
+                        if max(abs(oi), abs(oj)) < 2:
+                            continue
+                        ti_ = np.arange(a, m, 2)
+                        tj_ = np.arange(b, m, 2)
+                        ti_ = ti_[(ti_ + oi >= 0) & (ti_ + oi < m)]
+                        tj_ = tj_[(tj_ + oj >= 0) & (tj_ + oj < m)]
+                        if not ti_.size or not tj_.size:
+                            continue
+                        T = _m2l((oi + 1j * oj) * hl, p)
+                        local[np.ix_(ti_, tj_)] += M[np.ix_(ti_ + oi, tj_ + oj)] @ T
+
+    # Evaluate the local expansions at the points
+    local = local.reshape(n * n, p + 1)
+    tbox = ti * n + tj
+    wt = ((tx - x0) / size - (ti + 0.5) * h) + 1j * ((tz - z0) / size - (tj + 0.5) * h)
+    phi = np.zeros(tx.size, dtype=complex)
+    dphi = np.zeros(tx.size, dtype=complex)
+    chunk = max(1, max_pairs // (p + 1))
+    for t0 in range(0, tx.size, chunk):
+        ts = slice(t0, t0 + chunk)
+        coeffs = local[tbox[ts]]
+        w = wt[ts]
+        f = coeffs[:, p]
+        df = np.zeros_like(w)
+        for k in range(p - 1, -1, -1):
+            df = df * w + f
+            f = f * w + coeffs[:, k]
+        phi[ts] = f
+        dphi[ts] = df
+
+    # Add the neighbouring charges directly, in the same unit-square coordinates
+    with np.errstate(divide='ignore', invalid='ignore'):
+        near = _near_field((tx - x0) / size, (tz - z0) / size, tbox,
+                           (sx - x0) / size, (sz - z0) / size, sq, sbox, n, max_pairs)
+
+    # Undo the scaling: log|size w| = log(size) + log|w| and d/dw picks up 1/size
+    V = phi.real + near[2] + sq.sum() * np.log(size)
+    Bz = (dphi.real + near[1]) / size
+    Bx = (-dphi.imag + near[0]) / size
+    return Bx.reshape(shape), Bz.reshape(shape), V.reshape(shape)
+
+
+def validate(px, pz, charge_x, charge_z, weight, tol=DEFAULT_TOL, sample=2000, seed=0, **options):
+    """Compare :func:`fmm_charge_sum` with the direct kernel on a random sample of the points.
+
+    Returns the largest error of each component relative to the largest
+    magnitude of that component on the sample.
+    """
+    px, pz = np.broadcast_arrays(np.asarray(px, dtype=float), np.asarray(pz, dtype=float))
+    px, pz = px.ravel(), pz.ravel()
+    pick = np.random.default_rng(seed).choice(px.size, min(sample, px.size), replace=False)
+    fast = fmm_charge_sum(px, pz, charge_x, charge_z, weight, tol=tol, **options)
+    direct = charge_sum(px[pick], pz[pick], charge_x, charge_z, weight)
+    errors = {}
+    for name, f, d in zip(('Bx', 'Bz', 'V'), fast, direct):
+        finite = np.isfinite(d)
+        errors[name] = float(np.abs(f[pick][finite] - d[finite]).max() / np.abs(d[finite]).max())
+    return errors
@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from . import profiling
+
+
+@dataclass(frozen=True)
+class Grid:
+    """Regular evaluation grid ``x = linspace(xmin, xmax, nx)``, ``z = linspace(zmin, zmax, nz)``.
+
+    Field arrays on a grid follow the scripts' layout: element ``[i, j]``
+    belongs to the point ``(x[i], z[j])``.
+    """
+
+    xmin: float = -15.0
+    xmax: float = 15.0
+    nx: int = 100
+    zmin: float = -15.0
+    zmax: float = 15.0
+    nz: int = 100
+
+    @property
+    def x(self):
+        return np.linspace(self.xmin, self.xmax, self.nx)
+
+    @property
+    def z(self):
+        return np.linspace(self.zmin, self.zmax, self.nz)
+
+    @property
+    def shape(self):
+        return (self.nx, self.nz)
+
+    def points(self):
+        """Return broadcastable ``(x[:, None], z[None, :])`` point arrays."""
+        return self.x[:, None], self.z[None, :]
+
+    def meshgrid(self):
+        """Return ``np.meshgrid(x, z)`` as used by the plotting code."""
+        return np.meshgrid(self.x, self.z)
+
+
+@profiling.timed('evaluate')
+def evaluate(source, grid):
+    """Evaluate ``source`` on ``grid`` and return ``(Bx, Bz, V)`` indexed ``[i, j]``."""
+    return source.field(*grid.points())
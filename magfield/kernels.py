@@ -0,0 +1,447 @@
+import numpy as np
+
+from . import profiling
+from .backends import compiled, get_backend
+
+# Bump whenever a kernel's output changes, so cached fields are recomputed
+KERNEL_VERSION = 2
+
+# Upper bound on the number of (point, charge) pairs held in memory at once
+DEFAULT_MAX_PAIRS = 2 ** 21
+
+# Charge placements used by the ring scripts
+RING_LAYOUTS = ('outer_inner', 'pair', 'side')
+
+# Radial charge profiles of the analytic ring
+RING_PROFILES = ('ring', 'annulus')
+
+# Floating-point precisions of the kernels. In 'float32' the per-source terms
+# are computed in single precision, but they are summed in float64 because the
+# signed corner and north/south terms cancel far from the magnet.
+PRECISIONS = ('float64', 'float32')
+
+
+def _dtype(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown precision {precision!r}, expected one of {PRECISIONS}")
+    return np.dtype(precision)
+
+
+def _wide(a):
+    # Promote a per-source term to float64 before it is accumulated
+    return np.asarray(a).astype(np.float64, copy=False)
+
+
+def config_axis(ndim, *params):
+    """Reshape geometry parameters so they broadcast against points with ``ndim`` dimensions.
+
+    Every kernel accepts scalars or 1-D arrays of ``C`` configurations for its
+    geometry parameters; a 1-D array becomes ``(C, 1, ..., 1)`` so the outputs
+    gain a leading configuration axis.
+    """
+    return [np.reshape(p, np.shape(p) + (1,) * ndim) for p in params]
+
+
+@profiling.timed('kernel.rectangle')
+def rectangle_field(px, pz, length, height, magnetization, precision='float64'):
+    """Evaluate (Bx, Bz, V) of the four-corner rectangular magnet at the points (px, pz).
+
+    This is the corner kernel of the magnetic_field_1/2/3 scripts; corners are
+    numbered counter-clockwise from (-length/2, -height/2) and enter with
+    alternating signs.
+    """
+    dtype = _dtype(precision)
+    px = np.asarray(px, dtype=dtype)
+    pz = np.asarray(pz, dtype=dtype)
+    ndim = len(np.broadcast_shapes(px.shape, pz.shape))
+    if profiling.enabled():
+        _count_rectangle(px, pz, length, height)
+    if get_backend() == 'numba':
+        return _rectangle_compiled(px, pz, length, height, magnetization)
+    length, height, magnetization = (np.asarray(p, dtype=dtype)
+                                     for p in config_axis(ndim, length, height, magnetization))
+
+    # Offsets from the edges of the magnet; corners 1 and 4 share the left
+    # edge, 2 and 3 the right one, 1 and 2 the bottom face and 3 and 4 the top
+    dx_left = px + length / 2
+    dx_right = px - length / 2
+    dz_bottom = pz + height / 2
+    dz_top = pz - height / 2
+    corners = ((dx_left, dz_bottom, 1), (dx_right, dz_bottom, -1), (dx_right, dz_top, 1), (dx_left, dz_top, -1))
+
+    Bx = Bz = V = 0.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for dx, dz, sign in corners:
+            r2 = dx ** 2 + dz ** 2
+
+            # Magnetic field components
+            Bx = Bx + sign * _wide(np.arctan(dz * dx / r2))
+            Bz = Bz + sign * _wide(np.arctan(dz / dx))
+
+            # Magnetic potential, log(sqrt(r2)) = log(r2) / 2
+            V = V + sign * np.log(_wide(r2))
+    Bx, Bz, V = magnetization * Bx, magnetization * Bz, magnetization * 0.5 * V
+    return Bx.astype(dtype, copy=False), Bz.astype(dtype, copy=False), V.astype(dtype, copy=False)
+
+
+def _count_rectangle(px, pz, length, height):
+    # Corner evaluations, and those on a corner (log r) or in line with it (arctan(dz / dx))
+    length, height = config_axis(px.ndim, length, height)
+    dx = [px + length / 2, px - length / 2]
+    dz = [pz + height / 2, pz - height / 2]
+    shape = np.broadcast_shapes(dx[0].shape, dz[0].shape)
+    profiling.count('evaluations.rectangle', 4 * np.prod(shape))
+    for i, j in ((0, 0), (1, 0), (1, 1), (0, 1)):
+        aligned = np.broadcast_to(dx[i] == 0, shape)
+        profiling.count('singular.rectangle.dx0', np.count_nonzero(aligned))
+        profiling.count('singular.rectangle.r0', np.count_nonzero(aligned & (dz[j] == 0)))
+
+
+def _rectangle_compiled(px, pz, length, height, magnetization):
+    # One compiled pass per configuration over the flattened points
+    px, pz = np.broadcast_arrays(px, pz)
+    shape = px.shape
+    # Copies, since Numba warns on the writeable flag of np.broadcast_arrays views
+    px, pz = np.array(px).reshape(-1), np.array(pz).reshape(-1)
+    dtype = px.dtype
+    length, height, magnetization = (np.array(p) for p in np.broadcast_arrays(
+        *(np.asarray(p, dtype=dtype) for p in (length, height, magnetization))))
+    batch = length.shape
+    Bx, Bz, V = (np.empty(batch + (px.size,)) for _ in range(3))
+    for c in np.ndindex(batch):
+        compiled().rectangle_field(px, pz, length[c], height[c], magnetization[c], Bx[c], Bz[c], V[c])
+    return tuple(f.reshape(batch + shape).astype(dtype, copy=False) for f in (Bx, Bz, V))
+
+
+@profiling.timed('kernel.line_pair')
+def line_pair_field(px, pz, height, magnetization, precision='float64'):
+    """Evaluate (Bx, Bz, V) of the north/south line-charge pair at the points (px, pz).
+
+    This is the kernel of magnetic_field_4_checkpoint1.py: charges of opposite
+    sign at z = -height/2 (north) and z = +height/2 (south) on the z axis.
+    As in that script, Bx is identically zero.
+    """
+    dtype = _dtype(precision)
+    px, pz = np.broadcast_arrays(np.asarray(px, dtype=dtype), np.asarray(pz, dtype=dtype))
+    height, magnetization = (np.asarray(p, dtype=dtype) for p in config_axis(px.ndim, height, magnetization))
+
+    # Distances from the charges
+    dz_north = pz + height / 2
+    dz_south = pz - height / 2
+    px2 = px ** 2
+    r2_north = px2 + dz_north ** 2
+    r2_south = px2 + dz_south ** 2
+    if profiling.enabled():
+        profiling.count('evaluations.line_pair', r2_north.size + r2_south.size)
+        profiling.count('singular.line_pair.r0', np.count_nonzero(r2_north == 0) + np.count_nonzero(r2_south == 0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Magnetic field components
+        Bz = magnetization * (_wide(dz_north / r2_north) - _wide(dz_south / r2_south))
+
+        # Magnetic potential
+        V = magnetization * 0.5 * (np.log(_wide(r2_north)) - np.log(_wide(r2_south)))
+    Bx = np.zeros(Bz.shape, dtype=dtype)
+    return Bx, Bz.astype(dtype, copy=False), V.astype(dtype, copy=False)
+
+
+def ring_charges(layout, outer_radius, inner_radius, height, magnetization, num_charges):
+    """Return (charge_x, charge_z, weight, num_x, num_z) for a discretized ring.
+
+    ``layout`` selects the charge placement of one of the ring scripts:
+    'outer_inner' (ring_magnet.py), 'pair' (ring_magnet2.py) or
+    'side' (ring3.py, magnet2_withmagnet6.py). ``num_x``/``num_z`` are None
+    unless the layout uses fixed numerators instead of the offsets dx/dz.
+    Geometry parameters given as 1-D arrays of ``C`` configurations yield
+    ``(C, 2 * num_charges)`` charge arrays.
+    """
+    outer_radius, inner_radius, height, magnetization = (
+        np.reshape(p, np.shape(p) + (1,)) for p in (outer_radius, inner_radius, height, magnetization))
+
+    # Calculate the angle of the charges
+    angle = np.arange(num_charges) * 2 * np.pi / num_charges
+    sin, cos = np.sin(angle), np.cos(angle)
+    strength = magnetization / num_charges
+    ones = np.ones(num_charges)
+
+    if layout == 'outer_inner':
+        # Outer charges above and below, with numerators set by the outer-inner offset
+        charge_x = np.concatenate([outer_radius * cos, outer_radius * cos], axis=-1)
+        charge_z = np.concatenate([outer_radius * sin - height / 2, outer_radius * sin + height / 2], axis=-1)
+        weight = np.concatenate([strength * ones, -strength * ones], axis=-1)
+        num_x = np.concatenate([(inner_radius - outer_radius) * cos] * 2, axis=-1)
+        num_z = np.concatenate([(inner_radius - outer_radius) * sin] * 2, axis=-1)
+        return charge_x, charge_z, weight, num_x, num_z
+    if layout == 'pair':
+        # South (positive) and north (negative) copies of the ring shifted along z
+        charge_x = np.concatenate([outer_radius * cos, outer_radius * cos], axis=-1)
+        charge_z = np.concatenate([outer_radius * sin - height / 2, outer_radius * sin + height / 2], axis=-1)
+        weight = np.concatenate([strength * ones, -strength * ones], axis=-1)
+        return charge_x, charge_z, weight, None, None
+    if layout == 'side':
+        # North (positive) and south (negative) copies of the ring shifted along x
+        charge_x = np.concatenate([outer_radius * sin + height / 2, outer_radius * sin - height / 2], axis=-1)
+        charge_z = np.concatenate([outer_radius * cos, outer_radius * cos], axis=-1)
+        weight = np.concatenate([strength * ones, -strength * ones], axis=-1)
+        return charge_x, charge_z, weight, None, None
+    raise ValueError(f"unknown ring layout {layout!r}, expected one of {RING_LAYOUTS}")
+
+
+@profiling.timed('kernel.charge_sum')
+def charge_sum(px, pz, charge_x, charge_z, weight, num_x=None, num_z=None, max_pairs=DEFAULT_MAX_PAIRS,
+               precision='float64'):
+    """Sum the field of line charges at the points (px, pz).
+
+    Each charge adds ``weight * num_z / r**2`` to Bx, ``weight * num_x / r**2``
+    to Bz and ``weight * log(r)`` to V, where r is the distance from the charge
+    and num_x/num_z default to the offsets dx/dz, as in the ring scripts.
+    ``px`` and ``pz`` broadcast against each other; the outputs take their
+    shape. Charge arrays of shape ``(C, K)`` describe ``C`` configurations
+    and prepend a configuration axis to the outputs. Points and charges are
+    processed in blocks of at most ``max_pairs`` pairs so peak memory does not
+    grow with the grid size. With ``precision='float32'`` the pair terms are
+    computed in single precision and accumulated across blocks in float64.
+    The sums run on the backend of :func:`magfield.backends.get_backend` in
+    either precision.
+    """
+    dtype = _dtype(precision)
+    px, pz = np.broadcast_arrays(np.asarray(px, dtype=dtype), np.asarray(pz, dtype=dtype))
+    shape = px.shape
+    px = px.reshape(-1)
+    pz = pz.reshape(-1)
+    charges = [charge_x, charge_z, weight] + [n for n in (num_x, num_z) if n is not None]
+    charges = np.broadcast_arrays(*(np.asarray(c, dtype=dtype) for c in charges))
+    charge_x, charge_z, weight = charges[:3]
+    weight_wide = _wide(weight)
+    if num_x is not None:
+        num_x = charges[3]
+    if num_z is not None:
+        num_z = charges[-1]
+    batch = charge_x.shape[:-1]
+    configs = int(np.prod(batch))
+    if profiling.enabled():
+        profiling.count('evaluations.charge_sum', px.size * charge_x.size)
+        # Points that sit exactly on a charge, counted per configuration
+        points = px + 1j * pz
+        profiling.count('singular.charge_sum.r0', sum(np.count_nonzero(np.isin(points, charge_x[c] + 1j * charge_z[c]))
+                                                      for c in np.ndindex(batch)))
+
+    if get_backend() == 'numba':
+        # Copies, since Numba warns on the writeable flag of np.broadcast_arrays views
+        px, pz = np.array(px), np.array(pz)
+        empty = np.empty(0, dtype=dtype)
+        Bx, Bz, V = (np.empty(batch + (px.size,)) for _ in range(3))
+        for c in np.ndindex(batch):
+            compiled().charge_sum(px, pz, *(np.array(a[c]) for a in (charge_x, charge_z, weight)),
+                                  empty if num_x is None else np.array(num_x[c]),
+                                  empty if num_z is None else np.array(num_z[c]), Bx[c], Bz[c], V[c])
+        return tuple(f.reshape(batch + shape).astype(dtype, copy=False) for f in (Bx, Bz, V))
+
+    Bx = np.zeros(batch + (px.size,))
+    Bz = np.zeros(batch + (px.size,))
+    V = np.zeros(batch + (px.size,))
+
+    point_block = max(1, min(px.size, max_pairs // max(1, configs)))
+    charge_block = max(1, max_pairs // (point_block * max(1, configs)))
+
+    for p0 in range(0, px.size, point_block):
+        ps = slice(p0, p0 + point_block)
+        x = px[ps, None]
+        z = pz[ps, None]
+        for c0 in range(0, charge_x.shape[-1], charge_block):
+            cs = slice(c0, c0 + charge_block)
+
+            # Calculate the distances from the charges
+            dx = x - charge_x[..., None, cs]
+            dz = z - charge_z[..., None, cs]
+            r2 = dx ** 2 + dz ** 2
+            w = weight[..., cs, None]
+
+            # Magnetic field components
+            if num_z is None:
+                Bx[..., ps] += ((dz / r2) @ w)[..., 0]
+            else:
+                Bx[..., ps] += ((1 / r2) @ (w * num_z[..., cs, None]))[..., 0]
+            if num_x is None:
+                Bz[..., ps] += ((dx / r2) @ w)[..., 0]
+            else:
+                Bz[..., ps] += ((1 / r2) @ (w * num_x[..., cs, None]))[..., 0]
+
+            # Magnetic potential, log(sqrt(r2)) = log(r2) / 2; the logarithms of
+            # opposite charges cancel almost exactly, so they are always taken in float64
+            V[..., ps] += (np.log(_wide(r2)) @ (0.5 * weight_wide[..., cs, None]))[..., 0]
+
+    return (Bx.reshape(batch + shape).astype(dtype, copy=False), Bz.reshape(batch + shape).astype(dtype, copy=False),
+            V.reshape(batch + shape).astype(dtype, copy=False))
+
+
+def ring_field(px, pz, outer_radius, inner_radius, height, magnetization, num_charges,
+               layout='pair', max_pairs=DEFAULT_MAX_PAIRS, precision='float64'):
+    """Evaluate (Bx, Bz, V) of a discretized ring magnet at the points (px, pz)."""
+    charges = ring_charges(layout, outer_radius, inner_radius, height, magnetization, num_charges)
+    return charge_sum(px, pz, *charges, max_pairs=max_pairs, precision=precision)
+
+
+def ring_centers(layout, height, magnetization):
+    """Return the ``(center_x, center_z, weight)`` of each ring in a layout.
+
+    Every ring of ``ring_charges`` is a circle of charges with total weight
+    ``weight`` around one of these centres.
+    """
+    if layout in ('outer_inner', 'pair'):
+        return [(0.0, -height / 2, magnetization), (0.0, height / 2, -magnetization)]
+    if layout == 'side':
+        return [(height / 2, 0.0, magnetization), (-height / 2, 0.0, -magnetization)]
+    raise ValueError(f"unknown ring layout {layout!r}, expected one of {RING_LAYOUTS}")
+
+
+def _xlogx(a):
+    # a * log(a) with the limit 0 at a = 0
+    return np.where(a > 0, a * np.log(np.where(a > 0, a, 1)), 0.0)
+
+
+@profiling.timed('kernel.analytic_ring')
+def analytic_ring_field(px, pz, outer_radius, inner_radius, height, magnetization,
+                        layout='pair', profile='ring', precision='float64'):
+    """Evaluate (Bx, Bz, V) of continuous rings in closed form at the points (px, pz).
+
+    This is the ``num_charges -> infinity`` limit of :func:`ring_field`. For the
+    2-D ``log r`` kernel the angular average over a circle of radius R is
+    elementary: the potential is ``log(max(rho, R))`` and the field is that of
+    the enclosed charge at the centre, so each point costs O(1).
+
+    With ``profile='annulus'`` the charge of each ring is spread uniformly
+    between ``inner_radius`` and ``outer_radius`` instead of sitting on
+    ``outer_radius``. The 'outer_inner' layout, whose numerators are fixed by
+    the two radii, only supports ``profile='ring'``. In 'float32' each ring's
+    terms are single precision and the rings are summed in float64.
+    """
+    dtype = _dtype(precision)
+    if profile not in RING_PROFILES:
+        raise ValueError(f"unknown ring profile {profile!r}, expected one of {RING_PROFILES}")
+    if layout == 'outer_inner' and profile != 'ring':
+        raise ValueError("the 'outer_inner' layout only supports profile='ring'")
+    if profile == 'annulus' and not np.all((0 <= np.asarray(inner_radius)) & (np.asarray(inner_radius) < outer_radius)):
+        raise ValueError("the annulus profile needs 0 <= inner_radius < outer_radius")
+
+    px, pz = np.broadcast_arrays(np.asarray(px, dtype=dtype), np.asarray(pz, dtype=dtype))
+    outer_radius, inner_radius, height, magnetization = (np.asarray(p, dtype=dtype) for p in config_axis(
+        px.ndim, outer_radius, inner_radius, height, magnetization))
+    shape = np.broadcast_shapes(px.shape, outer_radius.shape, inner_radius.shape, height.shape, magnetization.shape)
+    Bx = np.zeros(shape)
+    Bz = np.zeros(shape)
+    V = np.zeros(shape)
+
+    R2 = outer_radius ** 2
+    r2 = inner_radius ** 2
+    if profiling.enabled():
+        profiling.count('evaluations.analytic_ring', 2 * np.prod(shape))
+
+    for center_x, center_z, weight in ring_centers(layout, height, magnetization):
+        # Offsets from the centre of the ring
+        dx = px - center_x
+        dz = pz - center_z
+        rho2 = dx ** 2 + dz ** 2
+        if layout == 'outer_inner' and profiling.enabled():
+            profiling.count('singular.analytic_ring.on_ring', np.count_nonzero(np.broadcast_to(rho2 == R2, shape)))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if layout == 'outer_inner':
+                # Average of exp(i angle) / |w - R exp(i angle)|**2 over the ring
+                scale = np.where(rho2 < R2, 1 / (outer_radius * (R2 - rho2)),
+                                 outer_radius / (rho2 * (rho2 - R2)))
+                Bx += weight * (inner_radius - outer_radius) * scale * dz
+                Bz += weight * (inner_radius - outer_radius) * scale * dx
+                V += weight * 0.5 * np.log(_wide(np.maximum(rho2, R2)))
+            elif profile == 'ring':
+                enclosed = np.where(rho2 >= R2, weight / rho2, dtype.type(0))
+                Bx += enclosed * dz
+                Bz += enclosed * dx
+                V += weight * 0.5 * np.log(_wide(np.maximum(rho2, R2)))
+            else:
+                # Fraction of the annulus charge inside radius rho
+                a2 = np.clip(rho2, r2, R2)
+                enclosed = np.where(a2 > r2, weight * (a2 - r2) / ((R2 - r2) * rho2), dtype.type(0))
+                Bx += enclosed * dz
+                Bz += enclosed * dx
+                inner_log = np.where(a2 > r2, 0.5 * np.log(np.where(a2 > r2, rho2, 1)) * (a2 - r2), 0.0)
+                V += weight * (inner_log + 0.5 * (_xlogx(R2) - _xlogx(a2)) - 0.5 * (R2 - a2)) / (R2 - r2)
+    return Bx.astype(dtype, copy=False), Bz.astype(dtype, copy=False), V.astype(dtype, copy=False)
+
+
+def _graded_nodes(panels, order, ratio):
+    # Gauss-Legendre nodes on [0, pi] in panels that shrink geometrically towards 0
+    edges = np.concatenate([[0.0], np.pi * ratio ** np.arange(panels - 1, -1, -1.0)])
+    nodes, weights = np.polynomial.legendre.leggauss(order)
+    start, stop = edges[:-1, None], edges[1:, None]
+    return ((start + stop + (stop - start) * nodes) / 2).ravel(), ((stop - start) * weights / 2).ravel()
+
+
+# Angular quadrature of axisymmetric_ring_field. The closest point of a face to
+# the evaluation point is always at angle 0, so one graded rule resolves the
+# faces and their edges down to ~1e-9 of the radius for every point.
+AXISYMMETRIC_NODES, AXISYMMETRIC_WEIGHTS = _graded_nodes(panels=20, order=8, ratio=1 / 3)
+
+
+@profiling.timed('kernel.axisymmetric_ring')
+def axisymmetric_ring_field(pr, pz, outer_radius, inner_radius, height, magnetization, max_pairs=DEFAULT_MAX_PAIRS):
+    """Evaluate (Br, Bz, V) of a 3-D cylindrical ring magnet at the points (pr, pz).
+
+    The ring occupies ``inner_radius < rho < outer_radius``, ``|z| < height/2``
+    and is magnetized along z, which puts surface charge ``+magnetization`` on
+    the top face and ``-magnetization`` on the bottom face. ``V`` is their 3-D
+    potential ``sigma / (4 pi |r - r'|)`` and ``(Br, Bz) = -grad V`` is the
+    field of the charges (H, which equals B outside the magnet). Unlike the
+    2-D kernels this follows the physical sign convention.
+
+    ``pr`` is the cylindrical radius; negative values are mirrored through the
+    axis, so a grid symmetric in x gives the cross-section through the axis.
+    The radial integral over each face is done in closed form and the angular
+    one with :data:`AXISYMMETRIC_NODES`.
+    """
+    pr, pz = np.broadcast_arrays(np.asarray(pr, dtype=float), np.asarray(pz, dtype=float))
+    shape = pr.shape
+    sign = np.where(pr < 0, -1.0, 1.0).reshape(-1)
+    r = np.abs(pr).reshape(-1)
+    pz = pz.reshape(-1)
+    outer_radius, inner_radius, height, magnetization = config_axis(
+        2, outer_radius, inner_radius, height, magnetization)
+    batch = np.broadcast_shapes(*(p.shape[:-2] for p in (outer_radius, inner_radius, height, magnetization)))
+    configs = int(np.prod(batch))
+
+    Br = np.zeros(batch + (r.size,))
+    Bz = np.zeros(batch + (r.size,))
+    V = np.zeros(batch + (r.size,))
+
+    # Both halves of the angle range contribute equally, and each face carries 1 / (4 pi)
+    c = np.cos(AXISYMMETRIC_NODES)
+    s2 = np.sin(AXISYMMETRIC_NODES) ** 2
+    weights = AXISYMMETRIC_WEIGHTS / (2 * np.pi)
+    block = max(1, max_pairs // (c.size * max(1, configs)))
+    profiling.count('evaluations.axisymmetric_ring', 4 * c.size * r.size * configs)
+
+    for p0 in range(0, r.size, block):
+        ps = slice(p0, p0 + block)
+        rr = r[ps, None]
+        rc = rr * c
+        for face_z, sigma in ((height / 2, magnetization), (-height / 2, -magnetization)):
+            dz = pz[ps, None] - face_z
+            h2 = rr ** 2 * s2 + dz ** 2
+            for radius, charge in ((outer_radius, sigma), (inner_radius, -sigma)):
+                # Antiderivative in the face radius a of a / |r - r'| and its r and z derivatives,
+                # with w = 1 / (a - r cos + D) written so it does not cancel
+                u = radius - rc
+                D = np.sqrt(u ** 2 + h2)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    w = np.where(u > 0, 1 / (D + np.abs(u)), (D + np.abs(u)) / h2)
+                    L = -np.log(w)
+                    F = D + rc * L
+                    Fr = (rr - radius * c) / D + c * L + rc * (rr * s2 * w - c) / D
+                    Fz = dz * (1 + rc * w) / D
+
+                V[..., ps] += charge[..., 0] * (F @ weights)
+                Br[..., ps] -= charge[..., 0] * (Fr @ weights)
+                Bz[..., ps] -= charge[..., 0] * (Fz @ weights)
+
+    Br *= sign
+    return Br.reshape(batch + shape), Bz.reshape(batch + shape), V.reshape(batch + shape)
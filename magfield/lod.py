@@ -0,0 +1,178 @@
+"""Level-of-detail reduction of large field grids for rendering.
+
+A :class:`FieldPyramid` is built once from the ``(Bx, Bz, V)`` arrays of a
+grid. Level ``k`` merges blocks of ``2**k x 2**k`` grid points and keeps
+the min, max and sum of ``V`` and ``|B|`` per block, the sums of ``Bx`` and
+``Bz`` and the number of finite points; non-finite values (on a charge or
+corner) are left out. Level 0 shares the field arrays, and each further
+level is built from the one below in O(N), so the pyramid adds about a
+third of the grid per statistic.
+
+For a view of ``pixels`` on screen, :meth:`FieldPyramid.level_for` picks
+the coarsest level with at least one block per pixel, so the image drawn
+from it has a bounded size whatever the grid size. :meth:`FieldPyramid.arrows`
+averages the field over screen cells of a given size in pixels with
+``np.add.reduceat`` on a level a few blocks finer than the cells, instead of
+keeping every ``stride``-th arrow. See :func:`magfield.plotting.plot_field_lod`.
+"""
+
+import numpy as np
+
+from .grid import Grid, evaluate
+
+# Statistics kept per block for the image fields
+STATS = ('min', 'max', 'mean')
+
+# Fields of FieldPyramid.image: the potential and the field magnitude
+IMAGE_FIELDS = ('V', 'B')
+
+# Default screen cell of one arrow, in pixels
+DEFAULT_ARROW_PIXELS = 24
+
+# Blocks of the aggregated level per arrow cell and axis
+ARROW_OVERSAMPLE = 4
+
+
+def _pairs(ufunc, values):
+    # Reduce blocks of 2x2 points with ``ufunc``; odd trailing rows and columns form their own blocks.
+    # Strided slices are several times faster than ufunc.reduceat here.
+    for axis in (0, 1):
+        index = [slice(None), slice(None)]
+        index[axis] = slice(0, None, 2)
+        out = values[tuple(index)].copy()
+        index[axis] = slice(1, None, 2)
+        second = values[tuple(index)]
+        index[axis] = slice(0, second.shape[axis])
+        head = out[tuple(index)]
+        ufunc(head, second, out=head)
+        values = out
+    return values
+
+
+def _halve(count, vectors, images):
+    """Return the next level from counts, ``{name: sums}`` of vectors and ``{name: (sum, min, max)}``."""
+    level = {'count': _pairs(np.add, count), **{name: _pairs(np.add, s) for name, s in vectors.items()}}
+    for name, (total, low, high) in images.items():
+        level[f'{name}.sum'] = _pairs(np.add, total)
+        level[f'{name}.min'] = _pairs(np.fmin, low)
+        level[f'{name}.max'] = _pairs(np.fmax, high)
+    return level
+
+
+def _span(coordinates, limits):
+    # Index range [start, stop) of the sorted grid coordinates inside ``limits``
+    if limits is None:
+        return 0, coordinates.size
+    low, high = sorted(limits)
+    start = max(int(np.searchsorted(coordinates, low, side='right')) - 1, 0)
+    stop = min(int(np.searchsorted(coordinates, high, side='left')) + 1, coordinates.size)
+    return start, max(stop, start + 1)
+
+
+class FieldPyramid:
+    """Min/max/mean pyramid of ``V`` and ``|B|`` over ``grid``, with summed field vectors for arrows.
+
+    ``Bx``, ``Bz`` and ``V`` are indexed ``[i, j]`` like :func:`magfield.grid.evaluate`
+    returns them. ``levels[k]`` maps ``'count'``, ``'Bx'``, ``'Bz'`` and
+    ``'<field>.<min|max|sum>'`` to arrays of ``ceil(n / 2**k)`` blocks per axis.
+    """
+
+    def __init__(self, grid, Bx, Bz, V):
+        self.grid = grid
+        fields = {'Bx': np.asarray(Bx, dtype=float), 'Bz': np.asarray(Bz, dtype=float),
+                  'V': np.asarray(V, dtype=float)}
+        fields['B'] = np.hypot(fields['Bx'], fields['Bz'])
+        finite = np.isfinite(fields['B']) & np.isfinite(fields['V'])
+        if not finite.all():
+            fields = {name: np.where(finite, values, np.nan) for name, values in fields.items()}
+
+        # Level 0 keeps the fields themselves, with NaN on singular points, as sum, min and max
+        level = {'count': finite, 'Bx': fields['Bx'], 'Bz': fields['Bz'],
+                 **{f'{name}.{stat}': fields[name] for name in IMAGE_FIELDS for stat in ('sum', 'min', 'max')}}
+        self.levels = [level]
+        zero = (lambda values: values) if finite.all() else (lambda values: np.where(finite, values, 0.0))
+        if max(finite.shape) > 1:
+            level = _halve(finite.astype(np.int64), {name: zero(fields[name]) for name in ('Bx', 'Bz')},
+                           {name: (zero(fields[name]), fields[name], fields[name]) for name in IMAGE_FIELDS})
+            self.levels.append(level)
+        while max(level['count'].shape) > 1:
+            level = _halve(level['count'], {name: level[name] for name in ('Bx', 'Bz')},
+                           {name: tuple(level[f'{name}.{stat}'] for stat in ('sum', 'min', 'max'))
+                            for name in IMAGE_FIELDS})
+            self.levels.append(level)
+
+    @classmethod
+    def from_source(cls, source, grid=None, cache=None):
+        """Evaluate ``source`` on ``grid`` (through ``cache`` if given) and build its pyramid."""
+        grid = grid if grid is not None else Grid()
+        fields = cache.evaluate(source, grid) if cache is not None else evaluate(source, grid)
+        return cls(grid, *fields)
+
+    def _window(self, xlim, zlim):
+        return _span(self.grid.x, xlim), _span(self.grid.z, zlim)
+
+    def level_for(self, pixels, xlim=None, zlim=None):
+        """Return the coarsest level with at least one block per pixel of the ``(width, height)`` view."""
+        spans = self._window(xlim, zlim)
+        points = min((stop - start) / max(int(n), 1) for (start, stop), n in zip(spans, pixels))
+        return int(np.clip(np.floor(np.log2(max(points, 1))), 0, len(self.levels) - 1))
+
+    def _blocks(self, k, xlim, zlim):
+        # Block slices of level k covering the view, and the extent they cover in data coordinates
+        grid = self.grid
+        step = (grid.xmax - grid.xmin) / max(grid.nx - 1, 1), (grid.zmax - grid.zmin) / max(grid.nz - 1, 1)
+        slices, extent = [], []
+        for (start, stop), lo, d, n in zip(self._window(xlim, zlim), (grid.xmin, grid.zmin), step,
+                                           self.levels[k]['count'].shape):
+            first, last = start >> k, min(-(-stop >> k), n)
+            slices.append(slice(first, last))
+            # The last block of a level may cover fewer points; it is drawn at full width
+            extent += [lo + ((first << k) - 0.5) * d, lo + ((last << k) - 0.5) * d]
+        return tuple(slices), extent
+
+    def image(self, field='V', stat='mean', pixels=(640, 480), xlim=None, zlim=None):
+        """Return ``(values, extent, level)`` of ``stat`` of ``field`` for a view of ``pixels``.
+
+        ``values`` is indexed ``[i, j]`` over the blocks in view and ``extent``
+        is ``(x0, x1, z0, z1)`` for ``imshow(values.T, origin='lower')``.
+        Blocks without finite values are NaN.
+        """
+        if field not in IMAGE_FIELDS or stat not in STATS:
+            raise ValueError(f"unknown image {field!r}/{stat!r}, expected a field of {IMAGE_FIELDS} "
+                             f"and a statistic of {STATS}")
+        k = self.level_for(pixels, xlim, zlim)
+        window, extent = self._blocks(k, xlim, zlim)
+        level = self.levels[k]
+        if stat == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = level[f'{field}.sum'][window] / level['count'][window]
+        else:
+            values = level[f'{field}.{stat}'][window]
+        return values, extent, k
+
+    def arrows(self, pixels=(640, 480), cell=DEFAULT_ARROW_PIXELS, xlim=None, zlim=None):
+        """Return ``(X, Z, U, W)`` of the mean field over screen cells of ``cell`` pixels.
+
+        The arrays are indexed ``[j, i]`` like ``np.meshgrid`` output, ready
+        for ``quiver``. Cells without finite values get zero-length arrows.
+        """
+        cells = [max(1, int(round(n / cell))) for n in pixels]
+        k = self.level_for([n * ARROW_OVERSAMPLE for n in cells], xlim, zlim)
+        window, extent = self._blocks(k, xlim, zlim)
+        level = self.levels[k]
+        count = level['count'][window]
+        sums = [np.where(count > 0, level[name][window], 0.0) for name in ('Bx', 'Bz')] + [count.astype(np.int64)]
+
+        # Split the blocks in view into the screen cells along each axis and sum each cell
+        centers = []
+        for axis, n in enumerate(cells):
+            size = sums[0].shape[axis]
+            starts = np.unique(np.linspace(0, size, min(n, size) + 1).astype(int)[:-1])
+            sums = [np.add.reduceat(s, starts, axis=axis) for s in sums]
+            edges = np.linspace(extent[2 * axis], extent[2 * axis + 1], size + 1)
+            centers.append((edges[starts] + edges[np.append(starts[1:], size)]) / 2)
+        Bx, Bz, count = sums
+        with np.errstate(invalid='ignore', divide='ignore'):
+            U, W = (np.where(count > 0, s / count, 0.0) for s in (Bx, Bz))
+        X, Z = np.meshgrid(*centers)
+        return X, Z, U.T, W.T
@@ -0,0 +1,154 @@
+"""Tiled multi-process grid evaluation writing into shared memory.
+
+Run ``python -m magfield.parallel`` for a scaling report.
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .grid import Grid
+
+# Default tile edge, in grid points along x and z
+DEFAULT_TILE = 256
+
+# Output arrays and shared state of the worker process, set up once by _attach
+_worker = {}
+
+
+def process_pool(workers, **options):
+    """Return a ``ProcessPoolExecutor`` whose workers do not inherit this process's threads.
+
+    Workers are started by a fork server (or spawned where there is none)
+    instead of forked from this process: once the Numba backend has started
+    its threading layer here, forked workers hang the interpreter at exit.
+    Tasks, initializer arguments and their sources are therefore pickled.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method), **options)
+
+
+def tiles(shape, tile=DEFAULT_TILE):
+    """Yield ``(slice_i, slice_j)`` blocks covering an array of ``shape``."""
+    tile_x, tile_z = (tile, tile) if np.isscalar(tile) else tile
+    for i0 in range(0, shape[0], tile_x):
+        for j0 in range(0, shape[1], tile_z):
+            yield slice(i0, min(i0 + tile_x, shape[0])), slice(j0, min(j0 + tile_z, shape[1]))
+
+
+def _attach(names, shape, state):
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    _worker.clear()
+    _worker.update(state)
+    _worker['blocks'] = blocks
+    _worker['arrays'] = [np.ndarray(shape, dtype=float, buffer=b.buf) for b in blocks]
+
+
+def _call(fill, task):
+    fill(task, _worker['arrays'], _worker)
+
+
+def map_shared(fill, tasks, shape, workers=None, **state):
+    """Run ``fill(task, arrays, state)`` for every task and return the three output arrays.
+
+    ``arrays`` are the ``(Bx, Bz, V)`` outputs of ``shape`` and ``state`` holds
+    the keyword arguments. With more than one worker the tasks run on a process
+    pool whose workers attach once to shared-memory outputs and write their
+    results in place, so no field data is pickled. ``fill`` must be a
+    module-level function and ``state`` picklable, see :func:`process_pool`.
+    ``workers`` defaults to the CPU count; with one worker the tasks run in
+    this process.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        arrays = [np.empty(shape) for _ in range(3)]
+        for task in tasks:
+            fill(task, arrays, state)
+        return tuple(arrays)
+
+    nbytes = max(1, int(np.prod(shape)) * np.dtype(float).itemsize)
+    blocks = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(3)]
+    try:
+        names = [b.name for b in blocks]
+        with process_pool(workers, initializer=_attach, initargs=(names, shape, state)) as pool:
+            for _ in pool.map(partial(_call, fill), tasks):
+                pass
+        return tuple(np.ndarray(shape, dtype=float, buffer=b.buf).copy() for b in blocks)
+    finally:
+        for b in blocks:
+            b.close()
+            b.unlink()
+
+
+def _fill_tile(tile, arrays, state):
+    si, sj = tile
+    fields = state['source'].field(state['x'][si, None], state['z'][None, sj])
+    for out, values in zip(arrays, fields):
+        out[si, sj] = values
+
+
+def evaluate_parallel(source, grid, workers=None, tile=DEFAULT_TILE):
+    """Evaluate ``source`` on ``grid`` with a process pool and return ``(Bx, Bz, V)`` indexed ``[i, j]``.
+
+    The grid is split into ``tile``-sized blocks (an int or an ``(nx, nz)``
+    pair) that are written straight into shared-memory outputs, see
+    :func:`map_shared`. ``workers`` defaults to the CPU count.
+    """
+    return map_shared(_fill_tile, list(tiles(grid.shape, tile)), grid.shape, workers,
+                      source=source, x=grid.x, z=grid.z)
+
+
+def scaling_report(source, grid, worker_counts=None, tile=DEFAULT_TILE, repeat=1):
+    """Time ``evaluate_parallel`` for each worker count and return rows of timings.
+
+    Each row is a dict with ``workers``, ``seconds`` (best of ``repeat``),
+    ``speedup`` relative to the first worker count and ``efficiency``
+    (speedup per added worker relative to the first count).
+    """
+    if worker_counts is None:
+        cpus = os.cpu_count() or 1
+        worker_counts = sorted({1, *(2 ** k for k in range(cpus.bit_length()) if 2 ** k <= cpus), cpus})
+    rows = []
+    for workers in worker_counts:
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            evaluate_parallel(source, grid, workers=workers, tile=tile)
+            best = min(best, time.perf_counter() - start)
+        rows.append({'workers': workers, 'seconds': best})
+    for row in rows:
+        row['speedup'] = rows[0]['seconds'] / row['seconds']
+        row['efficiency'] = row['speedup'] * rows[0]['workers'] / row['workers']
+    return rows
+
+
+def main(argv=None):
+    from .sources import AnalyticRing, LineChargePair, Rectangle, RingCharges
+
+    sources = {'rectangle': Rectangle(), 'line_pair': LineChargePair(),
+               'ring': RingCharges(), 'analytic_ring': AnalyticRing()}
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', choices=sorted(sources), default='ring')
+    parser.add_argument('--size', type=int, default=400, help='grid points along each axis')
+    parser.add_argument('--tile', type=int, default=DEFAULT_TILE)
+    parser.add_argument('--workers', type=int, nargs='+', help='worker counts to time')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    grid = Grid(-15, 15, args.size, -15, 15, args.size)
+    rows = scaling_report(sources[args.source], grid, args.workers, args.tile, args.repeat)
+    print(f"{args.source} on {args.size}x{args.size}, tile {args.tile}")
+    print(f"{'workers':>8} {'seconds':>10} {'speedup':>8} {'efficiency':>10}")
+    for row in rows:
+        print(f"{row['workers']:>8} {row['seconds']:>10.3f} {row['speedup']:>8.2f} {row['efficiency']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Plotting helpers. matplotlib is imported on first use only."""
+
+import numpy as np
+
+from . import profiling
+
+
+def _pyplot():
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def plot_field(mesh, arrows, stride=1, minlength=0.1, scale=40, rectangles=(), circles=(),
+               xlabel='x', ylabel='z', title=None, aspect=None, edgecolor='r'):
+    """Draw the potential as a colormap with field arrows and magnet boundaries on top.
+
+    ``mesh`` is the ``(X, Z, V)`` triple passed to ``pcolormesh`` and
+    ``arrows`` the ``(X, Z, U, W)`` quadruple passed to ``quiver`` after
+    applying ``stride``. ``rectangles`` holds ``(xy, width, height)`` and
+    ``circles`` holds ``(center, radius)`` boundary outlines.
+    """
+    plt = _pyplot()
+
+    # Create the plot
+    fig, ax = plt.subplots()
+
+    # Plot the magnetic potential as a colormap
+    with profiling.stage('render.pcolormesh'):
+        c = ax.pcolormesh(*mesh, cmap='coolwarm', shading='auto')
+        fig.colorbar(c, ax=ax, label='Magnetic Potential')
+
+    # Plot the magnetic field as small arrows
+    # Use a stride to reduce arrow density
+    with profiling.stage('render.quiver'):
+        arrows = [a[::stride, ::stride] for a in arrows]
+        ax.quiver(*arrows, color='k', minlength=minlength, pivot='middle', scale=scale)
+
+    _decorate(ax, rectangles, circles, xlabel, ylabel, title, aspect, edgecolor)
+    return fig, ax
+
+
+def _decorate(ax, rectangles, circles, xlabel, ylabel, title, aspect, edgecolor):
+    plt = _pyplot()
+
+    # Draw the magnet's boundary
+    for xy, width, height in rectangles:
+        ax.add_patch(plt.Rectangle(xy, width, height, linewidth=1, edgecolor=edgecolor, facecolor='none'))
+    for center, radius in circles:
+        ax.add_patch(plt.Circle(center, radius, linewidth=1, edgecolor=edgecolor, facecolor='none'))
+
+    # Set plot labels
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if title is not None:
+        ax.set_title(title)
+    if aspect is not None:
+        ax.set_aspect(aspect)
+
+
+def plot_field_lod(pyramid, field='V', stat='mean', cell=24, minlength=0.1, scale=40, rectangles=(), circles=(),
+                   xlabel='x', ylabel='z', title=None, aspect=None, edgecolor='r'):
+    """Draw a :class:`magfield.lod.FieldPyramid` like :func:`plot_field`, at the detail the axes can show.
+
+    The colormap shows ``stat`` (``'min'``, ``'max'`` or ``'mean'``) of
+    ``field`` (``'V'`` or ``'B'`` for ``|B|``) from the pyramid level with
+    about one block per pixel, and each arrow is the mean field over a
+    screen cell of ``cell`` pixels. Zooming, panning or resizing redraws
+    both from the level that fits the new view and rescales the colours to
+    the finite values in it.
+    """
+    plt = _pyplot()
+    grid = pyramid.grid
+    fig, ax = plt.subplots()
+    ax.set_xlim(grid.xmin, grid.xmax)
+    ax.set_ylim(grid.zmin, grid.zmax)
+
+    def view():
+        box = ax.get_window_extent()
+        return (max(int(box.width), 1), max(int(box.height), 1)), ax.get_xlim(), ax.get_ylim()
+
+    pixels, xlim, zlim = view()
+    with profiling.stage('render.image'):
+        values, extent, _ = pyramid.image(field, stat, pixels, xlim, zlim)
+        image = ax.imshow(values.T, origin='lower', extent=extent, cmap='coolwarm', interpolation='nearest',
+                          aspect='auto')
+        fig.colorbar(image, ax=ax, label='Magnetic Potential' if field == 'V' else '|B|')
+
+    arrows = {}
+
+    def draw_arrows(pixels, xlim, zlim):
+        with profiling.stage('render.quiver'):
+            if 'quiver' in arrows:
+                arrows['quiver'].remove()
+            arrows['quiver'] = ax.quiver(*pyramid.arrows(pixels, cell, xlim, zlim), color='k', minlength=minlength,
+                                         pivot='middle', scale=scale)
+
+    def refresh(_):
+        pixels, xlim, zlim = view()
+        if arrows.get('view') == (pixels, xlim, zlim):
+            return
+        arrows['view'] = (pixels, xlim, zlim)
+        values, extent, _ = pyramid.image(field, stat, pixels, xlim, zlim)
+        image.set_data(values.T)
+        image.set_extent(extent)
+        # Rescale the colours to the view, as imshow did for the first one
+        finite = values[np.isfinite(values)]
+        if finite.size:
+            lo, hi = finite.min(), finite.max()
+            image.set_clim(lo, hi if hi > lo else lo + 1)
+        draw_arrows(pixels, xlim, zlim)
+
+    arrows['view'] = (pixels, xlim, zlim)
+    draw_arrows(pixels, xlim, zlim)
+    ax.callbacks.connect('xlim_changed', refresh)
+    ax.callbacks.connect('ylim_changed', refresh)
+    fig.canvas.mpl_connect('resize_event', refresh)
+
+    _decorate(ax, rectangles, circles, xlabel, ylabel, title, aspect, edgecolor)
+    return fig, ax
+
+
+def plot_lines(ax, lines, color='k', linewidth=0.8):
+    """Draw field lines from :func:`magfield.fieldlines.trace` on ``ax`` as one collection."""
+    from matplotlib.collections import LineCollection
+
+    collection = LineCollection([line for line in lines if len(line) > 1], colors=color, linewidths=linewidth)
+    ax.add_collection(collection)
+    return collection
+
+
+def show():
+    """Show all open figures."""
+    with profiling.stage('render.show'):
+        _pyplot().show()
@@ -0,0 +1,101 @@
+"""Accuracy and speed of the single-precision kernels.
+
+Every source takes ``precision='float32'``, which computes the per-source
+terms (corner arctans, 1/r**2 of each charge pair) in single precision and
+returns float32 arrays, halving memory and bandwidth. The terms are still
+summed in float64, and logarithms feeding the potential are taken in
+float64, because the signed contributions of opposite poles cancel almost
+exactly away from the magnet. Both precisions run on the selected kernel
+backend (see :mod:`magfield.backends`). On NumPy, float32 is faster because
+the block temporaries are half the size. The fused Numba kernels keep no
+temporaries and spend most of their time on the float64 logarithms, so
+there float32 runs at about the speed of float64 and only saves the memory
+of the outputs. :func:`precision_report` measures the error and the speed
+on a given scene and backend, so the trade-off can be checked before
+switching a script over::
+
+    python -m magfield.precision --source ring --size 400
+"""
+
+import argparse
+import dataclasses
+import time
+
+import numpy as np
+
+from .backends import get_backend
+from .cache import FIELD_NAMES
+from .grid import Grid, evaluate
+
+
+def field_errors(reference, approximate):
+    """Return per-component errors of ``approximate`` against ``reference``.
+
+    Both are ``(Bx, Bz, V)`` tuples. For each component the dict holds
+    ``max_abs``, ``max_rel`` (max error over the max magnitude of the
+    reference) and ``rms_rel`` (RMS error over the RMS of the reference).
+    Non-finite reference values, as on a corner or charge, are skipped.
+    """
+    errors = {}
+    for name, ref, approx in zip(FIELD_NAMES, reference, approximate):
+        ref = np.asarray(ref, dtype=float)
+        keep = np.isfinite(ref)
+        ref = ref[keep]
+        error = np.abs(np.asarray(approx, dtype=float)[keep] - ref)
+        if not ref.size:
+            errors[name] = {'max_abs': 0.0, 'max_rel': 0.0, 'rms_rel': 0.0}
+            continue
+        scale = np.abs(ref).max() or 1.0
+        rms = np.sqrt(np.mean(ref ** 2)) or 1.0
+        error = np.where(np.isfinite(error), error, np.inf)
+        errors[name] = {'max_abs': float(error.max()), 'max_rel': float(error.max() / scale),
+                        'rms_rel': float(np.sqrt(np.mean(error ** 2)) / rms)}
+    return errors
+
+
+def _timed(source, grid, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fields = evaluate(source, grid)
+        best = min(best, time.perf_counter() - start)
+    return fields, best
+
+
+def precision_report(source, grid, repeat=1):
+    """Evaluate ``source`` in float64 and float32 on ``grid`` and compare them.
+
+    Returns a dict with the float32 ``errors`` (see :func:`field_errors`),
+    the best wall time of each precision in ``seconds``, the ``speedup``
+    of float32 and the kernel ``backend`` both ran on.
+    """
+    reference, seconds64 = _timed(dataclasses.replace(source, precision='float64'), grid, repeat)
+    single, seconds32 = _timed(dataclasses.replace(source, precision='float32'), grid, repeat)
+    return {'errors': field_errors(reference, single),
+            'seconds': {'float64': seconds64, 'float32': seconds32},
+            'speedup': seconds64 / seconds32, 'backend': get_backend()}
+
+
+def main(argv=None):
+    from .sources import AnalyticRing, LineChargePair, Rectangle, RingCharges
+
+    sources = {'rectangle': Rectangle(), 'line_pair': LineChargePair(),
+               'ring': RingCharges(), 'analytic_ring': AnalyticRing()}
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', choices=sorted(sources), default='ring')
+    parser.add_argument('--size', type=int, default=400, help='grid points along each axis')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    grid = Grid(-15, 15, args.size, -15, 15, args.size)
+    report = precision_report(sources[args.source], grid, args.repeat)
+    seconds = report['seconds']
+    print(f"{args.source} on {args.size}x{args.size} ({report['backend']} backend): "
+          f"float64 {seconds['float64']:.3f} s, float32 {seconds['float32']:.3f} s, speedup x{report['speedup']:.2f}")
+    print(f"{'field':>6} {'max abs':>10} {'max rel':>10} {'rms rel':>10}")
+    for name, error in report['errors'].items():
+        print(f"{name:>6} {error['max_abs']:>10.2e} {error['max_rel']:>10.2e} {error['rms_rel']:>10.2e}")
+
+
+if __name__ == '__main__':
+    main()
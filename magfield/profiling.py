@@ -0,0 +1,192 @@
+"""Optional instrumentation of the kernels and the rendering.
+
+When profiling is on, the package records for the run:
+
+- wall and CPU time of every stage (``evaluate``, ``kernel.<name>``,
+  ``render.pcolormesh``, ...), inclusive of nested stages;
+- counters: kernel evaluations as points x sources (``evaluations.<kernel>``)
+  and singular evaluations such as a point on a corner or charge
+  (``singular.<kernel>.<case>``);
+- the peak traced array memory of every stage and of the whole run.
+
+It is off by default, and then every hook is a single ``None`` check per
+kernel call. Turn it on with :func:`enable` or by setting
+``MAGFIELD_PROFILE=profile.json`` (written at exit), optionally with
+``MAGFIELD_CPROFILE=run.prof`` for a cProfile dump; or run a script under it::
+
+    python -m magfield.benchmark profile --out profile.json --cprofile run.prof magnetic_field_1_B_and_V.py
+"""
+
+import atexit
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import time
+import tracemalloc
+from collections import Counter
+
+_recorder = None
+_disabled = contextlib.nullcontext()
+
+
+class Recorder:
+    """Stage timings, counters and memory peaks of one profiled run."""
+
+    def __init__(self, memory=True, cprofile=False):
+        self.stages = {}
+        self.counters = Counter()
+        self.memory = memory
+        self.peak_bytes = 0
+        self._open = []
+        self._started = (time.perf_counter(), time.process_time())
+        self._elapsed = None
+        self._tracing = memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        self.profile = cProfile.Profile() if cprofile else None
+        if self.profile is not None:
+            self.profile.enable()
+
+    def _track_peak(self):
+        # Fold the traced peak since the last reset into every open stage
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_bytes = max(self.peak_bytes, peak)
+        for entry in self._open:
+            entry['peak'] = max(entry['peak'], peak)
+        tracemalloc.reset_peak()
+        return current
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        entry = {'peak': 0, 'base': self._track_peak() if self.memory else 0}
+        self._open.append(entry)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            if self.memory:
+                self._track_peak()
+            self._open.pop()
+            stats = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_bytes': 0})
+            stats['calls'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+            stats['peak_bytes'] = max(stats['peak_bytes'], entry['peak'] - entry['base'])
+
+    def stop(self):
+        """Stop tracing and profiling; the recorded numbers stay available."""
+        if self.profile is not None:
+            self.profile.disable()
+        if self._elapsed is None:
+            wall, cpu = self._started
+            self._elapsed = (time.perf_counter() - wall, time.process_time() - cpu)
+        if self.memory and tracemalloc.is_tracing():
+            self._track_peak()
+            if self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+
+    def report(self):
+        """Return the recorded run as a JSON-able dict."""
+        if self._elapsed is not None:
+            wall, cpu = self._elapsed
+        else:
+            wall, cpu = time.perf_counter() - self._started[0], time.process_time() - self._started[1]
+        return {'wall': wall, 'cpu': cpu,
+                'peak_bytes': self.peak_bytes if self.memory else None,
+                'stages': self.stages, 'counters': dict(self.counters)}
+
+    def write(self, path, cprofile=None):
+        """Write :meth:`report` to ``path`` as JSON and the cProfile stats to ``cprofile``."""
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        if cprofile is not None and self.profile is not None:
+            self.profile.dump_stats(cprofile)
+
+
+def enabled():
+    """Return whether profiling is on; hooks that cost more than a check should test this first."""
+    return _recorder is not None
+
+
+def enable(memory=True, cprofile=False):
+    """Start recording into a fresh :class:`Recorder` and return it.
+
+    ``memory`` traces array allocations with tracemalloc, which slows
+    allocation-heavy code down; ``cprofile`` also runs cProfile.
+    """
+    global _recorder
+    disable()
+    _recorder = Recorder(memory, cprofile)
+    return _recorder
+
+
+def disable():
+    """Stop recording and return the last :class:`Recorder`, or None."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.stop()
+    return recorder
+
+
+def stage(name):
+    """Return a context manager that times the stage ``name`` when profiling is on."""
+    if _recorder is None:
+        return _disabled
+    return _recorder.stage(name)
+
+
+def timed(name):
+    """Decorate a function so each call is recorded as the stage ``name``."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with _recorder.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    """Add ``n`` to the counter ``name`` when profiling is on."""
+    if _recorder is not None:
+        _recorder.counters[name] += int(n)
+
+
+@contextlib.contextmanager
+def profiled(path=None, cprofile=None, memory=True):
+    """Profile the ``with`` block, writing the JSON report to ``path`` if given.
+
+    Yields the :class:`Recorder`; ``cprofile`` is a path for the cProfile stats.
+    """
+    recorder = enable(memory, cprofile is not None)
+    try:
+        yield recorder
+    finally:
+        disable()
+        if path is not None:
+            recorder.write(path, cprofile)
+        elif cprofile is not None:
+            recorder.profile.dump_stats(cprofile)
+
+
+def _from_environment():
+    path = os.environ.get('MAGFIELD_PROFILE')
+    if not path:
+        return
+    cprofile = os.environ.get('MAGFIELD_CPROFILE')
+    recorder = enable(cprofile=cprofile is not None)
+
+    def finish():
+        disable()
+        recorder.write(path, cprofile)
+    atexit.register(finish)
+
+
+_from_environment()
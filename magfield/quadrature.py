@@ -0,0 +1,155 @@
+"""Ring charges placed by quadrature to a tolerance instead of a fixed count.
+
+The ring scripts spread a fixed ``num_charges`` uniformly over each ring,
+which is a periodic trapezoidal rule for the continuous ring. That rule
+converges geometrically, like ``(rho / R)**N`` for a point at distance
+``rho`` from the centre of a ring of radius ``R`` (or ``(R / rho)**N``
+outside), so far points need a handful of charges and only points next to
+the ring need many. :func:`quadrature_ring_field` picks the count per
+point: it predicts a level from that rate, evaluates the nested rules of
+``N/2`` and ``N`` charges and moves points whose difference exceeds ``tol``
+to the next level. Points that ``max_charges`` cannot resolve are
+integrated on Gauss-Legendre panels graded towards the closest point of
+the ring, where orders 8 and 16 give the error estimate. The field is
+undefined on a ring itself, so points closer than the finest panel can
+resolve are returned as NaN with an infinite estimate.
+
+The result approximates the continuous ring, so
+:class:`magfield.sources.AnalyticRing` gives its exact value for checking.
+"""
+
+import numpy as np
+
+from .kernels import _graded_nodes, charge_sum, ring_centers
+
+# Default absolute tolerance per field component and point
+DEFAULT_TOL = 1e-6
+
+# Largest number of uniform charges per ring before switching to graded panels
+DEFAULT_MAX_CHARGES = 1024
+
+# Smallest number of uniform charges per ring
+BASE_CHARGES = 8
+
+# Graded panels for points next to the ring, at two orders for the error estimate
+PANEL_RULES = [_graded_nodes(panels=20, order=order, ratio=1 / 3) for order in (8, 16)]
+
+# Distance from a ring, relative to its radius, below which the finest panel cannot resolve a point
+ON_RING = np.pi * 3.0 ** -19
+
+
+def _circle(layout, angle):
+    # Offsets of the charges at ``angle`` from the centre of a unit ring, as placed by ring_charges
+    if layout == 'side':
+        return np.sin(angle), np.cos(angle)
+    return np.cos(angle), np.sin(angle)
+
+
+def _uniform(x, z, layout, center, weight, outer_radius, inner_radius, num_charges, offset):
+    # The num_charges-point trapezoidal rule, rotated by ``offset`` charge spacings
+    angle = (np.arange(num_charges) + offset) * 2 * np.pi / num_charges
+    cos, sin = _circle(layout, angle)
+    numerators = (None, None)
+    if layout == 'outer_inner':
+        numerators = ((inner_radius - outer_radius) * cos, (inner_radius - outer_radius) * sin)
+    return np.array(charge_sum(x, z, center[0] + outer_radius * cos, center[1] + outer_radius * sin,
+                               np.full(num_charges, weight / num_charges), *numerators))
+
+
+def _panels(x, z, layout, center, weight, outer_radius, inner_radius, rule):
+    # Graded Gauss-Legendre rule on both sides of the angle closest to each point
+    nodes, weights = rule
+    dx, dz = x - center[0], z - center[1]
+    closest = np.arctan2(dx, dz) if layout == 'side' else np.arctan2(dz, dx)
+    angle = closest[:, None] + np.concatenate([nodes, -nodes])
+    w = np.concatenate([weights, weights]) * weight / (2 * np.pi)
+    cos, sin = _circle(layout, angle)
+    ddx = dx[:, None] - outer_radius * cos
+    ddz = dz[:, None] - outer_radius * sin
+    r2 = ddx ** 2 + ddz ** 2
+    num_x, num_z = ddx, ddz
+    if layout == 'outer_inner':
+        num_x, num_z = (inner_radius - outer_radius) * cos, (inner_radius - outer_radius) * sin
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.array([(num_z / r2) @ w, (num_x / r2) @ w, (0.5 * np.log(r2)) @ w])
+
+
+def _ring(x, z, layout, center, weight, outer_radius, inner_radius, tol, max_charges):
+    """Return the ``(3, P)`` fields of one ring, their error estimates and the charges used per point."""
+    fields = np.zeros((3, x.size))
+    error = np.zeros(x.size)
+    charges = np.zeros(x.size, dtype=int)
+    if weight == 0:
+        return fields, error, charges
+
+    # Predicted trapezoidal level from the geometric convergence rate
+    levels = max(0, int(np.log2(max_charges / BASE_CHARGES)))
+    rho = np.hypot(x - center[0], z - center[1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.minimum(rho, outer_radius) / np.maximum(rho, outer_radius)
+        needed = np.log(tol / abs(weight)) / np.log(rate)
+    needed = np.where(np.isfinite(needed), needed, np.inf)
+    level = np.clip(np.ceil(np.log2(np.maximum(needed, 1) / BASE_CHARGES)), 0, levels + 1).astype(int)
+
+    for k in range(levels + 1):
+        index = np.flatnonzero(level == k)
+        if not index.size:
+            continue
+        half = BASE_CHARGES * 2 ** k // 2
+        coarse = _uniform(x[index], z[index], layout, center, weight, outer_radius, inner_radius, half, 0.0)
+        shifted = _uniform(x[index], z[index], layout, center, weight, outer_radius, inner_radius, half, 0.5)
+        fine = (coarse + shifted) / 2
+        with np.errstate(invalid='ignore'):
+            estimate = np.abs(fine - coarse).max(axis=0)
+        converged = estimate <= tol
+        done = index[converged]
+        fields[:, done] = fine[:, converged]
+        error[done] = estimate[converged]
+        charges[done] = 2 * half
+        level[index[~converged]] = k + 1
+
+    # Points the uniform rules could not resolve
+    index = np.flatnonzero(level > levels)
+    if index.size:
+        # The field of a continuous ring is undefined on it, and the panels would return the mean of
+        # its one-sided limits there with a small estimate, so those points are masked as unresolved
+        on_ring = np.abs(rho[index] - outer_radius) <= ON_RING * outer_radius
+        fields[:, index[on_ring]] = np.nan
+        error[index[on_ring]] = np.inf
+        index = index[~on_ring]
+        low, high = (_panels(x[index], z[index], layout, center, weight, outer_radius, inner_radius, rule)
+                     for rule in PANEL_RULES)
+        fields[:, index] = high
+        with np.errstate(invalid='ignore'):
+            error[index] = np.abs(high - low).max(axis=0)
+        charges[index] = 2 * PANEL_RULES[1][0].size
+    return fields, error, charges
+
+
+def quadrature_ring_field(px, pz, outer_radius, inner_radius, height, magnetization, layout='pair',
+                          tol=DEFAULT_TOL, max_charges=DEFAULT_MAX_CHARGES):
+    """Evaluate the continuous rings of ``layout`` at the points (px, pz) to about ``tol``.
+
+    Returns ``(Bx, Bz, V, error, charges)``: the fields, the estimated
+    absolute error of the worst component at each point and the number of
+    charges (summed over the rings) each point was evaluated with. Points on
+    a ring are NaN with an infinite error. Geometry
+    parameters may be 1-D arrays of configurations, as for the other kernels.
+    """
+    px, pz = np.broadcast_arrays(np.asarray(px, dtype=float), np.asarray(pz, dtype=float))
+    params = np.broadcast_arrays(*(np.asarray(p, dtype=float) for p in
+                                   (outer_radius, inner_radius, height, magnetization)))
+    batch = params[0].shape
+    outputs = [np.zeros(batch + px.shape) for _ in range(4)] + [np.zeros(batch + px.shape, dtype=int)]
+    x, z = px.reshape(-1), pz.reshape(-1)
+
+    for c in np.ndindex(batch):
+        outer, inner, h, m = (float(p[c]) for p in params)
+        rings = ring_centers(layout, h, m)
+        for center_x, center_z, weight in rings:
+            # Each ring gets an equal share of the tolerance
+            fields, error, charges = _ring(x, z, layout, (center_x, center_z), weight, outer, inner,
+                                           tol / len(rings), max_charges)
+            for output, values in zip(outputs, (*fields, error, charges)):
+                output[c] += values.reshape(px.shape)
+    return tuple(outputs)
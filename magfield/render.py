@@ -0,0 +1,150 @@
+"""Headless batch rendering of field figures.
+
+Scenes are rendered on the Agg canvas without pyplot, across a process
+pool. Each worker keeps one figure per grid layout, with its colormap mesh,
+colorbar, arrows and boundary patches, and only swaps in the data of the
+next scene before saving it as PNG, SVG or any other format matplotlib
+infers from the file name.
+"""
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from . import profiling
+from .grid import Grid, evaluate
+from .parallel import process_pool
+
+# Figures kept by this worker process, keyed by (grid, stride)
+_renderers = {}
+
+
+@dataclass(frozen=True)
+class Scene:
+    """One figure to render: a source on a grid, saved to ``path``.
+
+    ``rectangles`` and ``circles`` outline the magnet as in
+    :func:`magfield.plotting.plot_field`; ``scale`` is the quiver scale
+    (automatic when None).
+    """
+
+    source: object
+    path: str
+    grid: Grid = Grid()
+    title: str = None
+    stride: int = 2
+    scale: float = None
+    rectangles: tuple = ()
+    circles: tuple = ()
+    edgecolor: str = 'r'
+
+
+class Renderer:
+    """A reusable figure for scenes on one grid with one arrow stride."""
+
+    def __init__(self, grid, stride, dpi=100):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.grid = grid
+        self.stride = stride
+        self.fig = Figure(dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+
+        x, z = grid.x, grid.z
+        self.mesh = self.ax.pcolormesh(x, z, np.zeros(grid.shape).T, cmap='coolwarm', shading='auto')
+        self.fig.colorbar(self.mesh, ax=self.ax, label='Magnetic Potential')
+        X, Z = np.meshgrid(x[::stride], z[::stride])
+        self.quiver = self.ax.quiver(X, Z, np.ones_like(X), np.ones_like(Z), color='k', pivot='middle')
+        self.ax.set_xlabel('x')
+        self.ax.set_ylabel('z')
+        self.ax.set_xlim(grid.xmin, grid.xmax)
+        self.ax.set_ylim(grid.zmin, grid.zmax)
+        self.rectangles = []
+        self.circles = []
+
+    def _patches(self, pool, specs, make, update, edgecolor):
+        from matplotlib import patches
+
+        while len(pool) < len(specs):
+            patch = make(patches)
+            self.ax.add_patch(patch)
+            pool.append(patch)
+        for patch, spec in zip(pool, specs):
+            update(patch, spec)
+            patch.set_edgecolor(edgecolor)
+            patch.set_visible(True)
+        for patch in pool[len(specs):]:
+            patch.set_visible(False)
+
+    def render(self, scene, fields=None):
+        """Swap in the data of ``scene``, save the figure and return the path."""
+        Bx, Bz, V = evaluate(scene.source, scene.grid) if fields is None else fields
+
+        with profiling.stage('render.update'):
+            self._update(scene, Bx, Bz, V)
+        directory = os.path.dirname(scene.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with profiling.stage('render.savefig'):
+            self.fig.savefig(scene.path)
+        return scene.path
+
+    def _update(self, scene, Bx, Bz, V):
+        self.mesh.set_array(np.asarray(V).T)
+        finite = np.asarray(V)[np.isfinite(V)]
+        if finite.size:
+            lo, hi = np.percentile(finite, [1, 99])
+            self.mesh.set_clim(lo, hi if hi > lo else lo + 1)
+
+        s = self.stride
+        U, W = np.asarray(Bx)[::s, ::s].T, np.asarray(Bz)[::s, ::s].T
+        self.quiver.set_UVC(np.where(np.isfinite(U), U, 0), np.where(np.isfinite(W), W, 0))
+        self.quiver.scale = scene.scale
+
+        def update_rectangle(patch, spec):
+            xy, width, height = spec
+            patch.set_xy(xy)
+            patch.set_width(width)
+            patch.set_height(height)
+
+        def update_circle(patch, spec):
+            center, radius = spec
+            patch.set_center(center)
+            patch.set_radius(radius)
+
+        self._patches(self.rectangles, scene.rectangles,
+                      lambda p: p.Rectangle((0, 0), 1, 1, linewidth=1, facecolor='none'),
+                      update_rectangle, scene.edgecolor)
+        self._patches(self.circles, scene.circles,
+                      lambda p: p.Circle((0, 0), 1, linewidth=1, facecolor='none'),
+                      update_circle, scene.edgecolor)
+
+        self.ax.set_title(scene.title or '')
+
+
+def render(scene):
+    """Render ``scene`` with this process's reusable figure for its grid and stride."""
+    key = (scene.grid, scene.stride)
+    if key not in _renderers:
+        _renderers[key] = Renderer(scene.grid, scene.stride)
+    return _renderers[key].render(scene)
+
+
+def render_batch(scenes, workers=None):
+    """Render every scene and return the written paths, in order.
+
+    ``workers`` defaults to the CPU count; with one worker the scenes are
+    rendered in this process. The worker processes are started as described
+    in :func:`magfield.parallel.process_pool`.
+    """
+    scenes = list(scenes)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(scenes) <= 1:
+        return [render(scene) for scene in scenes]
+    with process_pool(workers) as pool:
+        chunksize = max(1, len(scenes) // (4 * workers))
+        return list(pool.map(render, scenes, chunksize=chunksize))
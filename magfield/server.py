@@ -0,0 +1,519 @@
+"""Local field-query server with request micro-batching.
+
+A :class:`FieldServer` keeps named sources, their interpolation grids and
+recently computed grid fields in memory, and answers JSON requests over
+HTTP/1.1 on a Unix socket or a localhost port, so notebooks and acquisition
+scripts can share one warm process instead of each recomputing its fields:
+
+- ``GET /sources`` lists the registered sources;
+- ``POST /sources`` with ``{"name", "type", "params"}`` registers one, where
+  ``type`` is a key of :data:`SOURCE_TYPES`;
+- ``POST /points`` with ``{"source", "points": [[x, z], ...], "mode", "tol"}``
+  returns ``Bx``, ``Bz`` and ``V`` at the points (``mode`` as in
+  :meth:`magfield.probe.Probe.query`; ``'interp'`` also returns the
+  ``error`` estimates and the ``exact`` mask);
+- ``POST /grid`` with ``{"source", "grid": {...Grid fields}, "stride"}``
+  returns ``x``, ``z`` and the field arrays indexed ``[i, j]``;
+- ``GET /stats`` returns request and batching counters.
+
+Point queries that arrive within ``window`` seconds of each other for the
+same source, mode and tolerance are concatenated into one vectorized call.
+Kernel calls and JSON encoding of grids run on a thread pool, so the event
+loop keeps accepting requests meanwhile; NumPy and the compiled kernels
+release the GIL while they compute. Non-finite values are sent as JSON
+``NaN``/``Infinity``, which Python's ``json`` reads back.
+
+``python -m magfield.server serve --unix /tmp/magfield.sock`` runs a server
+and ``python -m magfield.server load --unix /tmp/magfield.sock`` load-tests
+it and prints latency percentiles.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import stat
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import backends
+from .cache import FIELD_NAMES, cache_key, describe
+from .grid import Grid, evaluate
+from .probe import PROBE_MODES, Probe
+from .sources import AnalyticRing, AxisymmetricRing, LineChargePair, QuadratureRing, Rectangle, RingCharges
+
+# Source classes that can be registered by name over the wire
+SOURCE_TYPES = {cls.__name__: cls for cls in (Rectangle, LineChargePair, RingCharges, AnalyticRing,
+                                              QuadratureRing, AxisymmetricRing)}
+
+# Default TCP port on localhost
+DEFAULT_PORT = 8765
+
+# Default time a point query waits for others to join its batch, in seconds
+DEFAULT_WINDOW = 0.002
+
+# Batches are evaluated at once when they reach this many points
+DEFAULT_MAX_BATCH = 65536
+
+# Number of grid results kept in memory
+DEFAULT_GRID_ENTRIES = 16
+
+# Number of (source, mode, tol) point batchers kept; the least recently used are dropped
+MAX_BATCHERS = 64
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def default_sources():
+    """Return the script geometries the server starts with, by name."""
+    return {'rectangle': Rectangle(), 'line_pair': LineChargePair(),
+            'ring': RingCharges(), 'analytic_ring': AnalyticRing()}
+
+
+def _remove_socket(path, stale=True):
+    # Remove the Unix socket at ``path``, refusing to delete any other kind of file. With ``stale``
+    # the socket must also have nothing listening on it, so a running server keeps its path.
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    if stale:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                pass
+            else:
+                raise FileExistsError(f"a server is already listening on {path}")
+    os.unlink(path)
+
+
+def _tolerance(mode, tol):
+    # Validated tolerance of a point query; exact queries ignore it
+    if mode not in PROBE_MODES:
+        raise ValueError(f"unknown probe mode {mode!r}, expected one of {PROBE_MODES}")
+    if mode == 'exact' or tol is None:
+        return None
+    tol = float(tol)
+    if not np.isfinite(tol) or tol <= 0:
+        raise ValueError(f"tol must be a positive finite number, got {tol!r}")
+    return tol
+
+
+def _encode(payload):
+    return json.dumps(payload).encode()
+
+
+def _lists(payload):
+    # Arrays to nested lists, recursively through dicts
+    if isinstance(payload, dict):
+        return {key: _lists(value) for key, value in payload.items()}
+    if isinstance(payload, np.ndarray):
+        return payload.tolist()
+    return payload
+
+
+class _Batcher:
+    """Collect point queries and evaluate them together with ``run(points)``.
+
+    ``run`` takes an ``(N, 2)`` array and returns a dict of arrays whose
+    first axis runs over the points; each caller gets its own rows back.
+    """
+
+    def __init__(self, run, executor, window, max_points, stats):
+        self.run = run
+        self.executor = executor
+        self.window = window
+        self.max_points = max_points
+        self.stats = stats
+        self._pending = []
+        self._size = 0
+        self._timer = None
+        self._tasks = set()
+
+    def submit(self, points):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((points, future))
+        self._size += len(points)
+        if self.window <= 0 or self._size >= self.max_points:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._size = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._evaluate(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _evaluate(self, batch):
+        points = np.concatenate([p for p, _ in batch]) if len(batch) > 1 else batch[0][0]
+        self.stats['batches'] += 1
+        self.stats['batched_points'] += len(points)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.run, points)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        start = 0
+        for p, future in batch:
+            if not future.done():
+                future.set_result({name: values[start:start + len(p)] for name, values in results.items()})
+            start += len(p)
+
+
+class FieldServer:
+    """Answer field queries for named sources from warm in-memory state.
+
+    ``sources`` maps names to sources (by default :func:`default_sources`).
+    ``probe_grid`` is the interpolation grid of ``'interp'`` point queries
+    and ``cache`` an optional :class:`magfield.cache.FieldCache` behind both
+    it and grid queries; the last ``grid_entries`` grid results also stay in
+    memory. ``workers`` threads evaluate the batches.
+    """
+
+    def __init__(self, sources=None, workers=None, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH,
+                 probe_grid=None, cache=None, grid_entries=DEFAULT_GRID_ENTRIES):
+        self.sources = dict(default_sources() if sources is None else sources)
+        self.executor = ThreadPoolExecutor(workers or os.cpu_count() or 1, thread_name_prefix='magfield')
+        self.window = window
+        self.max_batch = max_batch
+        self.probe_grid = probe_grid if probe_grid is not None else Grid(-15, 15, 601, -15, 15, 601)
+        self.cache = cache
+        self.grid_entries = grid_entries
+        self.stats = Counter()
+        self._probes = {}
+        self._batchers = OrderedDict()
+        self._grids = OrderedDict()
+        self._computing = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _kernels(self):
+        # Serialize kernel calls when the compiled backend cannot run them concurrently
+        return contextlib.nullcontext() if backends.thread_safe() else self._lock
+
+    def register(self, name, type, params=None):
+        """Register a source of class ``SOURCE_TYPES[type]`` built from ``params`` under ``name``."""
+        if type not in SOURCE_TYPES:
+            raise ValueError(f"unknown source type {type!r}, expected one of {sorted(SOURCE_TYPES)}")
+        source = SOURCE_TYPES[type](**(params or {}))
+        self.sources[name] = source
+        self._probes.pop(name, None)
+        for key in [key for key in self._batchers if key[0] == name]:
+            del self._batchers[key]
+        return source
+
+    def _source(self, name):
+        if name not in self.sources:
+            raise KeyError(f"unknown source {name!r}")
+        return self.sources[name]
+
+    def _run_points(self, name, mode, tol):
+        source = self._source(name)
+        if mode == 'interp' and name not in self._probes:
+            self._probes[name] = Probe(source, self.probe_grid, self.cache)
+        probe = self._probes.get(name)
+
+        def run(points):
+            with self._kernels():
+                if mode == 'exact':
+                    return dict(zip(FIELD_NAMES, source.field(points[:, 0], points[:, 1])))
+                result = probe.query(points, mode, tol)
+            return {**dict(zip(FIELD_NAMES, result.fields())), 'exact': result.exact,
+                    **{f'error.{name}': error for name, error in result.error.items()}}
+        return run
+
+    async def points(self, name, points, mode='exact', tol=None):
+        """Return a dict of the fields of source ``name`` at the ``(N, 2)`` ``points``."""
+        tol = _tolerance(mode, tol)
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        key = (name, mode, tol)
+        if key in self._batchers:
+            self._batchers.move_to_end(key)
+        else:
+            self._batchers[key] = _Batcher(self._run_points(name, mode, tol), self.executor, self.window,
+                                           self.max_batch, self.stats)
+            # A dropped batcher still answers the queries it holds
+            while len(self._batchers) > MAX_BATCHERS:
+                self._batchers.popitem(last=False)
+        result = await self._batchers[key].submit(points)
+        errors = {key.split('.', 1)[1]: result.pop(key) for key in list(result) if key.startswith('error.')}
+        if errors:
+            result['error'] = errors
+        return result
+
+    def _compute_grid(self, source, grid):
+        with self._kernels():
+            if self.cache is not None:
+                return self.cache.evaluate(source, grid)
+            return evaluate(source, grid)
+
+    async def grid(self, name, grid):
+        """Return ``(Bx, Bz, V)`` of source ``name`` on ``grid``, sharing concurrent identical requests."""
+        source = self._source(name)
+        key = cache_key(source, grid)
+        if key in self._grids:
+            self.stats['grid_hits'] += 1
+            self._grids.move_to_end(key)
+            return self._grids[key]
+        if key not in self._computing:
+            self.stats['grid_misses'] += 1
+            loop = asyncio.get_running_loop()
+            self._computing[key] = loop.run_in_executor(self.executor, self._compute_grid, source, grid)
+        try:
+            fields = await asyncio.shield(self._computing[key])
+        finally:
+            self._computing.pop(key, None)
+        self._grids[key] = fields
+        while len(self._grids) > self.grid_entries:
+            self._grids.popitem(last=False)
+        return fields
+
+    async def handle(self, method, target, body):
+        """Return ``(status, response body)`` for one request."""
+        loop = asyncio.get_running_loop()
+        routes = {('GET', '/sources'), ('POST', '/sources'), ('POST', '/points'), ('POST', '/grid'), ('GET', '/stats')}
+        if (method, target) not in routes:
+            known = any(path == target for _, path in routes)
+            return (405, {'error': f"{method} not allowed on {target}"}) if known else \
+                (404, {'error': f"no route {target}"})
+        request = json.loads(body) if body else {}
+        if target == '/sources':
+            if method == 'POST':
+                self.register(request['name'], request['type'], request.get('params'))
+            return 200, {name: describe(source) for name, source in self.sources.items()}
+        if target == '/stats':
+            stats = dict(self.stats)
+            stats['mean_batch_points'] = stats.get('batched_points', 0) / max(stats.get('batches', 0), 1)
+            return 200, stats
+        if target == '/points':
+            result = await self.points(request['source'], request['points'], request.get('mode', 'exact'),
+                                       request.get('tol'))
+            return 200, _lists(result)
+        grid = Grid(**request.get('grid', {}))
+        stride = int(request.get('stride', 1))
+        fields = await self.grid(request['source'], grid)
+        payload = {'x': grid.x[::stride], 'z': grid.z[::stride],
+                   **{name: np.asarray(f)[::stride, ::stride] for name, f in zip(FIELD_NAMES, fields)}}
+        # Large grids take a while to encode, so keep that off the event loop too
+        return 200, await loop.run_in_executor(self.executor, _encode, _lists(payload))
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target, _ = line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                self.stats['requests'] += 1
+                try:
+                    status, payload = await self.handle(method, target.split('?', 1)[0], body)
+                except (KeyError, ValueError, TypeError) as error:
+                    message = error.args[0] if isinstance(error, KeyError) and error.args else error
+                    status, payload = 400, {'error': f"{type(error).__name__}: {message}"}
+                except Exception as error:
+                    status, payload = 500, {'error': f"{type(error).__name__}: {error}"}
+                if status != 200:
+                    self.stats['errors'] += 1
+                data = payload if isinstance(payload, bytes) else _encode(payload)
+                close = headers.get('connection', '').lower() == 'close'
+                writer.write(f"HTTP/1.1 {status} {STATUS[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\nConnection: {'close' if close else 'keep-alive'}"
+                             f"\r\n\r\n".encode() + data)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, path=None, host='127.0.0.1', port=DEFAULT_PORT):
+        """Listen on the Unix socket ``path``, or on ``host:port`` when it is None, and return the server.
+
+        A stale socket at ``path``, with nothing listening on it, is replaced; a socket another
+        server is listening on, or any other file there, raises ``FileExistsError``.
+        """
+        # Compile the kernels here: Numba's threading layer hangs at exit if a worker thread starts it
+        for source in self.sources.values():
+            source.field(np.zeros(1), np.ones(1))
+        if path is not None:
+            _remove_socket(path)
+            self._server = await asyncio.start_unix_server(self._connection, path)
+        else:
+            self._server = await asyncio.start_server(self._connection, host, port)
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+
+class Client:
+    """Asyncio client of a :class:`FieldServer`, one request at a time over a kept-alive connection."""
+
+    def __init__(self, path=None, host='127.0.0.1', port=DEFAULT_PORT):
+        self.path = path
+        self.host = host
+        self.port = port
+        self._reader = self._writer = None
+
+    async def request(self, method, target, payload=None):
+        """Send one request and return the decoded JSON response; raise RuntimeError on an error status."""
+        if self._writer is None:
+            if self.path is not None:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+            else:
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        body = b'' if payload is None else _encode(payload)
+        self._writer.write(f"{method} {target} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                           f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await self._writer.drain()
+        status = int((await self._reader.readline()).split()[1])
+        length = 0
+        while (line := await self._reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        response = json.loads(await self._reader.readexactly(length))
+        if status != 200:
+            raise RuntimeError(f"{status}: {response.get('error')}")
+        return response
+
+    async def points(self, source, points, mode='exact', tol=None):
+        return await self.request('POST', '/points', {'source': source, 'points': np.asarray(points).tolist(),
+                                                      'mode': mode, 'tol': tol})
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            with contextlib.suppress(ConnectionError):
+                await self._writer.wait_closed()
+            self._reader = self._writer = None
+
+
+async def load_test(path=None, host='127.0.0.1', port=DEFAULT_PORT, clients=32, requests=50, points=16,
+                    source='ring', mode='exact', tol=None, seed=0):
+    """Run ``clients`` concurrent clients sending ``requests`` point queries each; return a latency summary.
+
+    Each query holds ``points`` random points in the default grid's extent.
+    The summary has the latency percentiles in milliseconds, the request
+    rate and the server's batching counters.
+    """
+    rng = np.random.default_rng(seed)
+    latencies = []
+
+    async def run(client):
+        try:
+            for _ in range(requests):
+                query = rng.uniform(-15, 15, (points, 2))
+                start = time.perf_counter()
+                await client.points(source, query, mode, tol)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            await client.close()
+
+    # Warm up the source (and its interpolation grid) before timing
+    warm = Client(path, host, port)
+    await warm.points(source, [[0.0, 0.0]], mode, tol)
+    before = await warm.request('GET', '/stats')
+    start = time.perf_counter()
+    await asyncio.gather(*(run(Client(path, host, port)) for _ in range(clients)))
+    seconds = time.perf_counter() - start
+    after = await warm.request('GET', '/stats')
+    await warm.close()
+
+    milliseconds = np.array(latencies) * 1e3
+    batches = after.get('batches', 0) - before.get('batches', 0)
+    return {'requests': len(latencies), 'seconds': seconds, 'rate': len(latencies) / seconds,
+            **{f'p{q}': float(np.percentile(milliseconds, q)) for q in (50, 90, 99)},
+            'max': float(milliseconds.max()), 'batches': batches,
+            'mean_batch_requests': len(latencies) / max(batches, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help in (('serve', 'run a server'), ('load', 'load-test a server')):
+        command = commands.add_parser(name, help=help)
+        command.add_argument('--unix', help='Unix socket path (default: TCP on localhost)')
+        command.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve_parser, load_parser = commands.choices['serve'], commands.choices['load']
+    for command in (serve_parser, load_parser):
+        command.add_argument('--workers', type=int, help='evaluation threads (default: CPU count)')
+        command.add_argument('--window-ms', type=float, default=DEFAULT_WINDOW * 1e3,
+                             help='batching window; 0 evaluates every request on its own')
+    load_parser.add_argument('--in-process', action='store_true',
+                             help='start a server in this process on a temporary socket')
+    load_parser.add_argument('--clients', type=int, default=32)
+    load_parser.add_argument('--requests', type=int, default=50, help='requests per client')
+    load_parser.add_argument('--points', type=int, default=16, help='points per request')
+    load_parser.add_argument('--source', default='ring')
+    load_parser.add_argument('--mode', choices=PROBE_MODES, default='exact')
+    load_parser.add_argument('--tol', type=float)
+    args = parser.parse_args(argv)
+
+    async def serve():
+        server = FieldServer(workers=args.workers, window=args.window_ms / 1e3)
+        listener = await server.start(args.unix, port=args.port)
+        print(f"serving on {args.unix or f'http://127.0.0.1:{args.port}'}")
+        try:
+            await listener.serve_forever()
+        finally:
+            await server.close()
+
+    async def load():
+        server = None
+        path = args.unix
+        if args.in_process:
+            server = FieldServer(workers=args.workers, window=args.window_ms / 1e3)
+            path = os.path.join(tempfile.mkdtemp(prefix='magfield-'), 'server.sock')
+            await server.start(path)
+        try:
+            return await load_test(path, port=args.port, clients=args.clients, requests=args.requests,
+                                   points=args.points, source=args.source, mode=args.mode, tol=args.tol)
+        finally:
+            if server is not None:
+                await server.close()
+                _remove_socket(path, stale=False)
+                os.rmdir(os.path.dirname(path))
+
+    if args.command == 'serve':
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(serve())
+        return
+    summary = asyncio.run(load())
+    print(f"{summary['requests']} requests of {args.points} points from {args.clients} clients "
+          f"in {summary['seconds']:.2f} s ({summary['rate']:.0f} /s)")
+    print(f"latency ms: p50 {summary['p50']:.2f}  p90 {summary['p90']:.2f}  p99 {summary['p99']:.2f}  "
+          f"max {summary['max']:.2f}")
+    print(f"{summary['batches']} batches, {summary['mean_batch_requests']:.1f} requests per batch")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .fmm import DEFAULT_TOL, fmm_charge_sum
+from . import quadrature
+from .kernels import (DEFAULT_MAX_PAIRS, _dtype, analytic_ring_field, axisymmetric_ring_field, charge_sum,
+                      line_pair_field, rectangle_field, ring_centers, ring_charges)
+
+# Ways of evaluating a ring magnet, see ring_source
+RING_MODES = ('discrete', 'analytic', 'quadrature')
+
+# Ways of summing point charges: direct summation or the fast multipole method
+SUM_METHODS = ('direct', 'fmm')
+
+
+def _sum_charges(x, z, charges, method, tol, max_pairs, precision):
+    charge_x, charge_z, weight, num_x, num_z = charges
+    if method == 'direct':
+        return charge_sum(x, z, charge_x, charge_z, weight, num_x, num_z, max_pairs=max_pairs, precision=precision)
+    if method == 'fmm':
+        if num_x is not None or num_z is not None:
+            raise ValueError("method='fmm' needs plain point charges, not fixed numerators")
+        # The expansions always run in float64; only the result is narrowed
+        fields = fmm_charge_sum(x, z, charge_x, charge_z, weight, tol=tol, max_pairs=max_pairs)
+        return tuple(f.astype(_dtype(precision), copy=False) for f in fields)
+    raise ValueError(f"unknown summation method {method!r}, expected one of {SUM_METHODS}")
+
+
+class Source:
+    """A magnet that can evaluate its field on arbitrary points.
+
+    Subclasses implement ``field(x, z)``, which takes broadcastable coordinate
+    arrays and returns ``(Bx, Bz, V)`` with their broadcast shape.
+    """
+
+    def field(self, x, z):
+        raise NotImplementedError
+
+
+@dataclass(frozen=True)
+class Rectangle(Source):
+    """Rectangular magnet of the magnetic_field_1/2/3 scripts, centred on the origin.
+
+    ``precision='float32'`` evaluates in single precision, see
+    :data:`magfield.kernels.PRECISIONS`. :class:`LineChargePair`,
+    :class:`RingCharges`, :class:`PointCharges` and :class:`AnalyticRing` take
+    it as well; :class:`QuadratureRing` and :class:`AxisymmetricRing` always
+    evaluate in double precision, and :class:`Composite` sums its members'
+    fields in it.
+    """
+
+    length: float = 10.0
+    height: float = 4.0
+    magnetization: float = 1.0
+    precision: str = 'float64'
+
+    def field(self, x, z):
+        return rectangle_field(x, z, self.length, self.height, self.magnetization, self.precision)
+
+
+@dataclass(frozen=True)
+class LineChargePair(Source):
+    """North/south line-charge pair of magnetic_field_4_checkpoint1.py."""
+
+    height: float = 4.0
+    magnetization: float = 1.0
+    precision: str = 'float64'
+
+    def field(self, x, z):
+        return line_pair_field(x, z, self.height, self.magnetization, self.precision)
+
+
+@dataclass(frozen=True)
+class RingCharges(Source):
+    """Ring magnet discretized into ``num_charges`` line charges per ring.
+
+    ``layout`` picks the charge placement of one of the ring scripts, see
+    :func:`magfield.kernels.ring_charges`. ``method='fmm'`` sums the charges
+    with the fast multipole method to relative accuracy ``tol`` instead of
+    directly; it does not support the 'outer_inner' layout.
+    """
+
+    outer_radius: float = 5.0
+    inner_radius: float = 4.0
+    height: float = 4.0
+    magnetization: float = 1.0
+    num_charges: int = 1000
+    layout: str = 'pair'
+    method: str = 'direct'
+    tol: float = DEFAULT_TOL
+    precision: str = 'float64'
+    max_pairs: int = field(default=DEFAULT_MAX_PAIRS, compare=False, repr=False)
+
+    def charges(self):
+        """Return (charge_x, charge_z, weight, num_x, num_z) for this ring."""
+        return ring_charges(self.layout, self.outer_radius, self.inner_radius, self.height,
+                            self.magnetization, self.num_charges)
+
+    def field(self, x, z):
+        return _sum_charges(x, z, self.charges(), self.method, self.tol, self.max_pairs, self.precision)
+
+
+@dataclass(frozen=True, eq=False)
+class PointCharges(Source):
+    """Arbitrary set of line charges, for example a surface-charge model of a magnet.
+
+    Uses the conventions of :func:`magfield.kernels.charge_sum`; see
+    :class:`RingCharges` for ``method`` and ``tol``.
+    """
+
+    charge_x: np.ndarray
+    charge_z: np.ndarray
+    weight: np.ndarray
+    method: str = 'direct'
+    tol: float = DEFAULT_TOL
+    precision: str = 'float64'
+    max_pairs: int = field(default=DEFAULT_MAX_PAIRS, compare=False, repr=False)
+
+    def charges(self):
+        """Return (charge_x, charge_z, weight, num_x, num_z) with no fixed numerators."""
+        return self.charge_x, self.charge_z, self.weight, None, None
+
+    def field(self, x, z):
+        return _sum_charges(x, z, self.charges(), self.method, self.tol, self.max_pairs, self.precision)
+
+
+@dataclass(frozen=True)
+class AnalyticRing(Source):
+    """Continuous ring magnet evaluated in closed form.
+
+    This is the limit of :class:`RingCharges` for infinitely many charges, at
+    O(1) cost per point. ``profile='annulus'`` spreads the charge uniformly
+    between ``inner_radius`` and ``outer_radius``, see
+    :func:`magfield.kernels.analytic_ring_field`.
+    """
+
+    outer_radius: float = 5.0
+    inner_radius: float = 4.0
+    height: float = 4.0
+    magnetization: float = 1.0
+    layout: str = 'pair'
+    profile: str = 'ring'
+    precision: str = 'float64'
+
+    def field(self, x, z):
+        return analytic_ring_field(x, z, self.outer_radius, self.inner_radius, self.height,
+                                   self.magnetization, self.layout, self.profile, self.precision)
+
+    def cross_check(self, x, z, num_charges=1000, margin=None):
+        """Compare against the discrete summation and return the max abs error per component.
+
+        Points closer than ``margin`` to a ring are skipped, since the discrete
+        sum does not converge there; by default ``margin`` is five charge
+        spacings. Only ``profile='ring'`` has a discrete counterpart.
+        """
+        if self.profile != 'ring':
+            raise ValueError("only profile='ring' has a discrete counterpart")
+        discrete = RingCharges(self.outer_radius, self.inner_radius, self.height, self.magnetization,
+                               num_charges, self.layout)
+        if margin is None:
+            margin = 5 * 2 * np.pi * self.outer_radius / num_charges
+
+        x, z = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(z, dtype=float))
+        keep = np.ones(x.shape, dtype=bool)
+        for center_x, center_z, _ in ring_centers(self.layout, self.height, self.magnetization):
+            keep &= np.abs(np.hypot(x - center_x, z - center_z) - self.outer_radius) > margin
+        x, z = x[keep], z[keep]
+
+        errors = [np.abs(a - b) for a, b in zip(self.field(x, z), discrete.field(x, z))]
+        return {name: float(e.max()) if e.size else 0.0 for name, e in zip(('Bx', 'Bz', 'V'), errors)}
+
+
+@dataclass(frozen=True)
+class QuadratureRing(Source):
+    """Continuous ring magnet summed with as few charges per point as ``tol`` allows.
+
+    Far points use a handful of uniform charges and points next to a ring
+    graded Gauss-Legendre panels; see :mod:`magfield.quadrature`.
+    """
+
+    outer_radius: float = 5.0
+    inner_radius: float = 4.0
+    height: float = 4.0
+    magnetization: float = 1.0
+    layout: str = 'pair'
+    tol: float = quadrature.DEFAULT_TOL
+    max_charges: int = quadrature.DEFAULT_MAX_CHARGES
+
+    def field_with_error(self, x, z):
+        """Return ``(Bx, Bz, V)``, the estimated error per point and the charges used per point."""
+        *fields, error, charges = quadrature.quadrature_ring_field(
+            x, z, self.outer_radius, self.inner_radius, self.height, self.magnetization, self.layout,
+            self.tol, self.max_charges)
+        return tuple(fields), error, charges
+
+    def field(self, x, z):
+        return self.field_with_error(x, z)[0]
+
+    def report(self, x, z):
+        """Return the achieved error estimate and charge counts over the points as a dict.
+
+        ``max_error`` covers the points resolved to ``tol``; the rest are
+        counted as ``unresolved`` and ``achieved`` is the largest finite
+        estimate over all points, which exceeds ``tol`` when any were not
+        resolved. Points on a ring have an infinite estimate.
+        """
+        _, error, charges = self.field_with_error(x, z)
+        resolved = error <= self.tol
+        finite = error[np.isfinite(error)]
+        return {'tol': self.tol, 'max_error': float(error[resolved].max()) if resolved.any() else 0.0,
+                'achieved': float(finite.max()) if finite.size else 0.0,
+                'unresolved': int(np.count_nonzero(~resolved)),
+                'mean_charges': float(charges.mean()), 'median_charges': float(np.median(charges)),
+                'max_charges': int(charges.max())}
+
+
+@dataclass(frozen=True)
+class AxisymmetricRing(Source):
+    """3-D cylindrical ring magnet, axially magnetized, evaluated on the (r, z) half-plane.
+
+    ``field(r, z)`` returns ``(Br, Bz, V)``; see
+    :func:`magfield.kernels.axisymmetric_ring_field` for the conventions and
+    :class:`magfield.volume.RevolvedField` for the field in 3-D.
+    """
+
+    outer_radius: float = 5.0
+    inner_radius: float = 4.0
+    height: float = 4.0
+    magnetization: float = 1.0
+    max_pairs: int = field(default=DEFAULT_MAX_PAIRS, compare=False, repr=False)
+
+    def field(self, x, z):
+        return axisymmetric_ring_field(x, z, self.outer_radius, self.inner_radius, self.height,
+                                       self.magnetization, self.max_pairs)
+
+
+@dataclass(frozen=True)
+class Composite(Source):
+    """Several magnets in one scene; the field is the sum of their fields."""
+
+    sources: tuple = ()
+
+    def field(self, x, z):
+        shape = np.broadcast_shapes(np.shape(x), np.shape(z))
+        Bx, Bz, V = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+        for source in self.sources:
+            bx, bz, v = source.field(x, z)
+            Bx, Bz, V = Bx + bx, Bz + bz, V + v
+        return Bx, Bz, V
+
+
+def ring_source(mode='discrete', **geometry):
+    """Build a ring magnet evaluated by summation (``'discrete'``), in closed form (``'analytic'``)
+    or by adaptive quadrature (``'quadrature'``).
+
+    ``geometry`` holds the dataclass fields of :class:`RingCharges`,
+    :class:`AnalyticRing` or :class:`QuadratureRing`; ``num_charges`` is
+    ignored outside discrete mode.
+    """
+    if mode == 'discrete':
+        return RingCharges(**geometry)
+    if mode == 'analytic':
+        geometry.pop('num_charges', None)
+        return AnalyticRing(**geometry)
+    if mode == 'quadrature':
+        geometry.pop('num_charges', None)
+        return QuadratureRing(**geometry)
+    raise ValueError(f"unknown ring mode {mode!r}, expected one of {RING_MODES}")
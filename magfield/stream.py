@@ -0,0 +1,110 @@
+"""Out-of-core field evaluation, one tile at a time.
+
+:func:`iter_tiles` evaluates a source tile by tile straight from the 1-D
+grid axes, so neither the meshgrid nor the full field arrays are ever built.
+Consumers such as :class:`MemmapWriter`, :class:`MaxField` and
+:class:`LineProfile` take the tiles as they arrive; peak memory depends on
+the tile size only.
+"""
+
+import os
+
+import numpy as np
+
+from .cache import FIELD_NAMES
+from .parallel import DEFAULT_TILE, tiles
+
+
+def iter_tiles(source, grid, tile=DEFAULT_TILE):
+    """Yield ``(slice_i, slice_j, (Bx, Bz, V))`` for each tile of ``grid``.
+
+    The field arrays of a tile are indexed ``[i, j]`` like full-grid arrays,
+    relative to the tile origin.
+    """
+    x, z = grid.x, grid.z
+    for si, sj in tiles(grid.shape, tile):
+        yield si, sj, source.field(x[si, None], z[None, sj])
+
+
+class MemmapWriter:
+    """Write tiles into ``Bx.npy``, ``Bz.npy`` and ``V.npy`` memory-mapped files in ``directory``."""
+
+    def __init__(self, directory, grid):
+        os.makedirs(directory, exist_ok=True)
+        self.arrays = tuple(np.lib.format.open_memmap(os.path.join(directory, f'{name}.npy'), mode='w+',
+                                                      dtype=float, shape=grid.shape)
+                            for name in FIELD_NAMES)
+
+    def update(self, si, sj, fields):
+        for out, values in zip(self.arrays, fields):
+            out[si, sj] = values
+
+    def result(self):
+        for out in self.arrays:
+            out.flush()
+        return self.arrays
+
+
+class MaxField:
+    """Track the largest ``|B|`` over the grid and the ``(i, j)`` index where it occurs."""
+
+    def __init__(self):
+        self.value = -np.inf
+        self.index = None
+
+    def update(self, si, sj, fields):
+        Bx, Bz, _ = fields
+        magnitude = np.hypot(Bx, Bz)
+        if not np.isfinite(magnitude).any():
+            return
+        k = np.nanargmax(np.where(np.isfinite(magnitude), magnitude, np.nan))
+        i, j = np.unravel_index(k, magnitude.shape)
+        if magnitude[i, j] > self.value:
+            self.value = float(magnitude[i, j])
+            self.index = (si.start + int(i), sj.start + int(j))
+
+    def result(self):
+        return self.value, self.index
+
+
+class LineProfile:
+    """Collect ``(Bx, Bz, V)`` along one grid line.
+
+    With ``axis='x'`` the profile runs along x at ``z[index]``; with
+    ``axis='z'`` it runs along z at ``x[index]``. ``index`` defaults to the
+    middle of the grid.
+    """
+
+    def __init__(self, grid, axis='x', index=None):
+        if axis not in ('x', 'z'):
+            raise ValueError(f"axis must be 'x' or 'z', not {axis!r}")
+        self.axis = axis
+        length, other = (grid.nx, grid.nz) if axis == 'x' else (grid.nz, grid.nx)
+        self.index = other // 2 if index is None else index
+        self.profile = tuple(np.full(length, np.nan) for _ in FIELD_NAMES)
+
+    def update(self, si, sj, fields):
+        if self.axis == 'x':
+            if sj.start <= self.index < sj.stop:
+                for out, values in zip(self.profile, fields):
+                    out[si] = values[:, self.index - sj.start]
+        elif si.start <= self.index < si.stop:
+            for out, values in zip(self.profile, fields):
+                out[sj] = values[self.index - si.start, :]
+
+    def result(self):
+        return self.profile
+
+
+def stream(source, grid, *consumers, tile=DEFAULT_TILE):
+    """Evaluate ``source`` on ``grid`` tile by tile, feed every consumer and return their results."""
+    for si, sj, fields in iter_tiles(source, grid, tile):
+        for consumer in consumers:
+            consumer.update(si, sj, fields)
+    results = [consumer.result() for consumer in consumers]
+    return results[0] if len(results) == 1 else results
+
+
+def to_memmap(source, grid, directory, tile=DEFAULT_TILE):
+    """Stream the field of ``source`` on ``grid`` into ``.npy`` files in ``directory`` and return the memmaps."""
+    return stream(source, grid, MemmapWriter(directory, grid), tile=tile)
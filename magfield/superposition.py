@@ -0,0 +1,100 @@
+"""Superposition of unit-magnetization fields.
+
+Every kernel is linear in ``magnetization``, so the field of a scene of
+magnets with any magnetizations is a weighted sum of the fields each magnet
+produces at unit magnetization. :class:`FieldBasis` computes those unit
+fields once (optionally through the on-disk cache) and recombines them for
+new magnetizations, or for a whole sweep of them such as M(T) over a
+temperature series, without calling the kernels again.
+"""
+
+import dataclasses
+
+import numpy as np
+
+from .grid import evaluate
+
+
+def unit_source(source):
+    """Return ``(source at unit magnetization, its magnetization)``.
+
+    Sources without a ``magnetization`` field are returned with weight 1.
+    """
+    if any(f.name == 'magnetization' for f in dataclasses.fields(source)):
+        return dataclasses.replace(source, magnetization=1.0), source.magnetization
+    return source, 1.0
+
+
+class FieldBasis:
+    """Unit-magnetization fields of named magnets on one grid."""
+
+    def __init__(self, grid, cache=None):
+        self.grid = grid
+        self.cache = cache
+        self.magnetization = {}
+        self._fields = {}
+        self._stack = None
+
+    @property
+    def names(self):
+        return list(self._fields)
+
+    def add(self, name, source):
+        """Compute and store the unit field of ``source`` under ``name``.
+
+        The magnetization of ``source`` becomes the default weight of ``name``
+        in :meth:`combine`.
+        """
+        unit, magnetization = unit_source(source)
+        if self.cache is not None:
+            fields = self.cache.evaluate(unit, self.grid)
+        else:
+            fields = evaluate(unit, self.grid)
+        self._fields[name] = fields
+        self.magnetization[name] = magnetization
+        self._stack = None
+        return self
+
+    def stack(self):
+        """Return the basis as one ``(K, 3, nx, nz)`` array in the order of :attr:`names`."""
+        if self._stack is None:
+            self._stack = np.array([np.stack(fields) for fields in self._fields.values()])
+        return self._stack
+
+    def combine(self, **magnetization):
+        """Return ``(Bx, Bz, V)`` of the scene with the given magnetization per magnet.
+
+        Magnets that are not named keep the magnetization they were added with;
+        pass 0 to leave a magnet out of the scene.
+        """
+        unknown = set(magnetization) - set(self._fields)
+        if unknown:
+            raise KeyError(f"unknown magnets {sorted(unknown)}, the basis has {self.names}")
+        weights = np.array([magnetization.get(name, self.magnetization[name]) for name in self.names], dtype=float)
+        return tuple(self._weighted(weights[None])[0])
+
+    def combine_many(self, weights):
+        """Return ``(Bx, Bz, V)`` for every row of a ``(T, K)`` magnetization array.
+
+        Columns follow :attr:`names`; each output has shape ``(T, nx, nz)``.
+        """
+        weights = np.asarray(weights, dtype=float)
+        if weights.ndim != 2 or weights.shape[1] != len(self._fields):
+            raise ValueError(f"weights must have shape (T, {len(self._fields)})")
+        combined = self._weighted(weights)
+        return combined[:, 0], combined[:, 1], combined[:, 2]
+
+    def _weighted(self, weights):
+        # Weighted sum over the basis in which a magnet of weight 0 contributes exactly 0, not the
+        # 0 * inf = NaN of its singular points
+        stack = self.stack()
+        finite = np.isfinite(stack)
+        singular = [k for k in range(len(stack)) if not finite[k].all()]
+        if not singular:
+            return np.tensordot(weights, stack, axes=1)
+        combined = np.tensordot(weights, np.where(finite, stack, 0.0), axes=1)
+        for k in singular:
+            active = weights[:, k] != 0
+            combined[active] += (weights[active, k][:, None, None, None] *
+                                 np.where(finite[k], 0.0, stack[k])[None])
+        return combined
@@ -0,0 +1,113 @@
+"""Vectorized parameter sweeps over magnet geometries.
+
+The kernels accept 1-D arrays of configurations for their geometry
+parameters (see :func:`magfield.kernels.config_axis`), so a sweep evaluates
+a whole chunk of configurations in one call and stacks the results along a
+leading configuration axis.
+"""
+
+import dataclasses
+import itertools
+from dataclasses import dataclass
+
+import numpy as np
+
+from .grid import Grid
+from .kernels import DEFAULT_MAX_PAIRS
+from .parallel import map_shared
+
+# Source fields that cannot vary within one vectorized call; configurations
+# are grouped by their values and each group is evaluated separately
+GROUPED_FIELDS = ('num_charges', 'layout', 'profile', 'method', 'precision')
+
+
+@dataclass
+class SweepResult:
+    """Fields of a sweep, labelled by the parameters of each configuration.
+
+    ``Bx``, ``Bz`` and ``V`` have shape ``(C, nx, nz)``; ``params`` maps each
+    swept field name to its ``C`` values.
+    """
+
+    source: object
+    grid: Grid
+    params: dict
+    Bx: np.ndarray
+    Bz: np.ndarray
+    V: np.ndarray
+
+    def __len__(self):
+        return len(self.Bx)
+
+    def config(self, index):
+        """Return the swept parameter values of configuration ``index``."""
+        return {name: values[index].item() for name, values in self.params.items()}
+
+    def source_at(self, index):
+        """Return the source of configuration ``index``."""
+        return dataclasses.replace(self.source, **self.config(index))
+
+    def select(self, **values):
+        """Return the indices of the configurations matching every given parameter value."""
+        keep = np.ones(len(self), dtype=bool)
+        for name, value in values.items():
+            column = self.params[name]
+            keep &= np.isclose(column, value) if column.dtype.kind in 'fiu' else column == value
+        return np.flatnonzero(keep)
+
+    def fields(self, index):
+        """Return ``(Bx, Bz, V)`` of configuration ``index``."""
+        return self.Bx[index], self.Bz[index], self.V[index]
+
+
+def product(**axes):
+    """Return the Cartesian product of parameter axes as equal-length arrays for :func:`sweep`."""
+    names = list(axes)
+    combos = list(itertools.product(*axes.values()))
+    return {name: np.array([combo[k] for combo in combos]) for k, name in enumerate(names)}
+
+
+def _fill_configs(task, arrays, state):
+    index, grouped = task
+    params = {name: values[index] for name, values in state['params'].items() if name not in grouped}
+    source = dataclasses.replace(state['source'], **params, **grouped)
+    fields = source.field(state['x'][:, None], state['z'][None, :])
+    for out, values in zip(arrays, fields):
+        out[index] = values
+
+
+def sweep(source, grid, workers=1, chunk=None, **params):
+    """Evaluate ``source`` on ``grid`` for every configuration in ``params``.
+
+    ``params`` maps source field names to arrays that broadcast to ``C``
+    configurations (use :func:`product` for a Cartesian grid); fields not
+    given keep their value in ``source``. Configurations are evaluated
+    ``chunk`` at a time in one vectorized kernel call, spread over
+    ``workers`` processes, and returned as a :class:`SweepResult`.
+    """
+    names = list(params)
+    columns = np.broadcast_arrays(*(np.atleast_1d(np.asarray(params[name])) for name in names))
+    if any(column.ndim != 1 for column in columns):
+        raise ValueError("sweep parameters must broadcast to one dimension")
+    columns = dict(zip(names, columns))
+    count = len(next(iter(columns.values()))) if columns else 1
+    if chunk is None:
+        # Keep a chunk's intermediate arrays around the size of one kernel block
+        chunk = max(1, DEFAULT_MAX_PAIRS // (grid.nx * grid.nz))
+
+    grouped_names = [name for name in names if name in GROUPED_FIELDS]
+    groups = {}
+    for index in range(count):
+        key = tuple(columns[name][index].item() for name in grouped_names)
+        groups.setdefault(key, []).append(index)
+
+    tasks = []
+    for key, members in groups.items():
+        grouped = dict(zip(grouped_names, key))
+        members = np.array(members)
+        for start in range(0, len(members), chunk):
+            tasks.append((members[start:start + chunk], grouped))
+
+    Bx, Bz, V = map_shared(_fill_configs, tasks, (count,) + grid.shape, workers,
+                           source=source, params=columns, x=grid.x, z=grid.z)
+    return SweepResult(source, grid, columns, Bx, Bz, V)